@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from app.services.openai_service import openai_service
 from typing import List, Dict, Any, Optional
+import orjson
 
 router = APIRouter(prefix="/ai-feedback", tags=["ai-feedback"])
 
@@ -13,6 +15,7 @@ class AIFeedbackRequest(BaseModel):
     is_correct: bool
     topic_name: str
     user_performance_context: Dict[str, int]
+    question_id: Optional[str] = None
 
 class ChatMessage(BaseModel):
     role: str  # "user" or "assistant"
@@ -42,8 +45,10 @@ async def get_ai_feedback(request: AIFeedbackRequest):
             correct_answer=request.correct_answer,
             user_answer=request.user_answer,
             is_correct=request.is_correct,
+            rationale=None,
             topic_name=request.topic_name,
-            user_performance_context=request.user_performance_context
+            user_performance_context=request.user_performance_context,
+            question_id=request.question_id
         )
 
         return {
@@ -58,6 +63,40 @@ async def get_ai_feedback(request: AIFeedbackRequest):
             detail=f"Failed to generate AI feedback: {str(e)}"
         )
 
+@router.post(
+    "/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {"schema": {"type": "string"}}}}}
+)
+async def stream_ai_feedback(request: AIFeedbackRequest):
+    """
+    Stream AI-generated feedback for a practice question as server-sent events.
+
+    Each event is a JSON object: {"type": "field", "name", "value"} as soon as a
+    feedback field is complete, followed by {"type": "done", "feedback"}.
+
+    Args:
+        request: Feedback request with question details and user performance
+
+    Returns:
+        text/event-stream response
+    """
+    async def event_stream():
+        async for event in openai_service.stream_answer_feedback(
+            question_stem=request.question_stem,
+            question_type=request.question_type,
+            correct_answer=request.correct_answer,
+            user_answer=request.user_answer,
+            is_correct=request.is_correct,
+            rationale=None,
+            topic_name=request.topic_name,
+            user_performance_context=request.user_performance_context,
+            question_id=request.question_id
+        ):
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @router.post("/chat", response_model=Dict[str, Any])
 async def chat_with_ai(request: ChatRequest):
     """
@@ -218,12 +218,13 @@ async def get_module_questions(
         Module with questions
     """
     try:
-        # Verify module belongs to user's exam
+        # Only the user's own modules match (also enforced by RLS)
         module_response = (
             db.table("mock_exam_modules")
             .select("*, mock_exams!inner(user_id)")
             .eq("id", module_id)
             .eq("exam_id", exam_id)
+            .eq("mock_exams.user_id", user_id)
             .execute()
         )
 
@@ -233,11 +234,6 @@ async def get_module_questions(
             )
 
         module = module_response.data[0]
-        if module["mock_exams"]["user_id"] != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this module",
-            )
 
         # Remove nested exam data
         module_clean = {k: v for k, v in module.items() if k != "mock_exams"}
@@ -4,7 +4,7 @@ from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 from uuid import UUID
 import random
-from app.db import get_db
+import asyncio
 
 from app.models.study_plan import (
     SessionQuestionsResponse,
@@ -18,11 +18,15 @@ from app.services.answer_validation_service import AnswerValidationService
 from app.services.openai_service import openai_service
 from app.services.bkt_service import BKTService
 from app.services.analytics_service import AnalyticsService
+from app.services.mock_exam_service import MockExamService
 from app.core.auth import get_current_user, get_authenticated_client
 
 
 router = APIRouter(prefix="/practice-sessions", tags=["practice-sessions"])
 
+# Max OpenAI feedback requests in flight per batch, to stay under rate limits
+FEEDBACK_CONCURRENCY = 6
+
 
 class SubmitAnswerRequest(BaseModel):
     user_answer: List[str]
@@ -274,7 +278,8 @@ async def get_question_feedback(
             is_correct=is_correct,
             rationale=question.get("rationale"),
             topic_name=topic["name"],
-            user_performance_context=performance_context
+            user_performance_context=performance_context,
+            question_id=question["id"]
         )
 
         feedback = AIFeedbackContent(**feedback_dict)
@@ -345,69 +350,86 @@ async def generate_session_feedback(
         if not sq_response.data:
             return []
 
-        feedback_responses = []
-
-        for sq in sq_response.data:
-            question = sq["questions"]
-            topic = sq["topics"]
-
-            # Skip if no user answer
-            if not sq.get("user_answer"):
-                continue
+        answered = [sq for sq in sq_response.data if sq.get("user_answer")]
+        if not answered:
+            return []
 
-            # Check cache first
-            cached_feedback = db.table("ai_feedback").select("*").eq(
-                "session_question_id", sq["id"]
-            ).eq("user_id", user_id).eq("feedback_type", "both").execute()
+        # Load all cached feedback for these questions in one query
+        cached_response = db.table("ai_feedback").select(
+            "session_question_id, feedback_content"
+        ).in_(
+            "session_question_id", [sq["id"] for sq in answered]
+        ).eq("user_id", user_id).eq("feedback_type", "both").execute()
+        cached_by_sq = {
+            row["session_question_id"]: row["feedback_content"]
+            for row in cached_response.data
+        }
 
-            if cached_feedback.data:
-                feedback_responses.append(AIFeedbackResponse(
-                    session_question_id=UUID(sq["id"]),
-                    question_id=UUID(question["id"]),
-                    feedback=AIFeedbackContent(**cached_feedback.data[0]["feedback_content"]),
-                    is_cached=True
-                ))
+        # Performance context only depends on the topic
+        performance_by_topic = {}
+        pending = []
+        for sq in answered:
+            if sq["id"] in cached_by_sq:
                 continue
 
-            # Get user's performance on this topic
-            performance_context = service.get_topic_performance(sq["topic_id"], user_id)
+            if sq["topic_id"] not in performance_by_topic:
+                performance_by_topic[sq["topic_id"]] = service.get_topic_performance(
+                    sq["topic_id"], user_id
+                )
 
             # Determine if answer is correct
             user_answer = sq["user_answer"] or []
-            correct_answer = question["correct_answer"] or []
+            correct_answer = sq["questions"]["correct_answer"] or []
             is_correct = sorted(user_answer) == sorted(correct_answer)
+            pending.append((sq, user_answer, correct_answer, is_correct))
+
+        # Generate uncached feedback concurrently, a few requests at a time
+        semaphore = asyncio.Semaphore(FEEDBACK_CONCURRENCY)
+
+        async def generate(sq, user_answer, correct_answer, is_correct):
+            async with semaphore:
+                return await openai_service.generate_answer_feedback(
+                    question_stem=sq["questions"]["stem"],
+                    question_type=sq["questions"]["question_type"],
+                    correct_answer=correct_answer,
+                    user_answer=user_answer,
+                    is_correct=is_correct,
+                    rationale=sq["questions"].get("rationale"),
+                    topic_name=sq["topics"]["name"],
+                    user_performance_context=performance_by_topic[sq["topic_id"]],
+                    question_id=sq["questions"]["id"]
+                )
 
-            # Generate feedback using OpenAI
-            feedback_dict = await openai_service.generate_answer_feedback(
-                question_stem=question["stem"],
-                question_type=question["question_type"],
-                correct_answer=correct_answer,
-                user_answer=user_answer,
-                is_correct=is_correct,
-                rationale=question.get("rationale"),
-                topic_name=topic["name"],
-                user_performance_context=performance_context
-            )
-
-            feedback = AIFeedbackContent(**feedback_dict)
+        generated = await asyncio.gather(*(generate(*item) for item in pending))
 
-            # Store in cache
-            db.table("ai_feedback").insert({
+        generated_by_sq = {}
+        cache_rows = []
+        for (sq, _, _, is_correct), feedback_dict in zip(pending, generated):
+            generated_by_sq[sq["id"]] = feedback_dict
+            cache_rows.append({
                 "session_question_id": sq["id"],
                 "user_id": user_id,
                 "feedback_type": "both",
                 "feedback_content": feedback_dict,
                 "context_used": {
-                    "performance": performance_context,
+                    "performance": performance_by_topic[sq["topic_id"]],
                     "is_correct": is_correct
                 }
-            }).execute()
+            })
 
+        # Store in cache
+        if cache_rows:
+            db.table("ai_feedback").insert(cache_rows).execute()
+
+        feedback_responses = []
+        for sq in answered:
+            is_cached = sq["id"] in cached_by_sq
+            feedback_dict = cached_by_sq[sq["id"]] if is_cached else generated_by_sq[sq["id"]]
             feedback_responses.append(AIFeedbackResponse(
                 session_question_id=UUID(sq["id"]),
-                question_id=UUID(question["id"]),
-                feedback=feedback,
-                is_cached=False
+                question_id=UUID(sq["questions"]["id"]),
+                feedback=AIFeedbackContent(**feedback_dict),
+                is_cached=is_cached
             ))
 
         return feedback_responses
@@ -847,6 +869,10 @@ async def add_similar_question(
             )
         
         created_question = question_response.data[0]
+
+        # New active questions change the cached mock exam pools; questions.module
+        # ('math'/'english') doesn't match the pool's section keys, so clear them all
+        MockExamService.invalidate_pool()
         
         # Add the question to the session
         session_question_data = {
@@ -1000,28 +1026,26 @@ async def get_wrong_answers(
 @router.get("/completed")
 async def get_completed_sessions(
     limit: int = Query(20, ge=1, le=100),
-    db: Client = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user),
+    db: Client = Depends(get_authenticated_client)
 ):
     """
     Get completed practice sessions for the current user.
     
     Args:
         limit: Maximum number of sessions to return (1-100)
-        db: Database session
-        current_user: Current authenticated user
+        user_id: User ID from authentication token
+        db: Database client
         
     Returns:
         List of completed practice sessions with basic info
     """
     try:
-        user_id = current_user["id"]
-        
-        # Query completed sessions with study plan info
+        # Query completed sessions with study plan info; sessions are owned through their plan
         sessions_response = db.table("practice_sessions").select(
             "id, created_at, completed_at, session_number, total_questions, completed_questions, "
-            "study_plans(name)"
-        ).eq("user_id", user_id).eq("status", "completed").order(
+            "study_plans!inner(name, user_id)"
+        ).eq("study_plans.user_id", user_id).eq("status", "completed").order(
             "completed_at", desc=True
         ).limit(limit).execute()
         
@@ -34,33 +34,27 @@ async def get_user_profile(
     """
     service = ProfileService(supabase)
 
-    # Get base profile
-    profile = await service.get_user_profile(user_id)
-    if not profile:
+    # Get profile, preferences and stats in one call
+    bundle = await service.get_profile_bundle(user_id)
+    if not bundle:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User profile not found"
         )
 
-    # Get preferences
-    preferences = await service.get_user_preferences(user_id)
-
     # Get streak
     streak_service = StreakService(supabase)
     streak = await streak_service.get_user_streak(user_id)
 
-    # Get stats
-    stats = await service.get_user_stats(user_id)
-
     # Get recent achievements
     achievement_service = AchievementService(supabase)
     recent_achievements = await achievement_service.get_recent_achievements(user_id, limit=5)
 
     return ProfileResponse(
-        profile=profile,
-        preferences=preferences,
+        profile=bundle["profile"],
+        preferences=bundle["preferences"],
         streak=streak,
-        stats=stats,
+        stats=bundle["stats"],
         recent_achievements=recent_achievements
     )
 
@@ -123,20 +117,13 @@ async def upload_profile_photo(
                 detail="Invalid file type. Only JPEG, PNG, and WebP are allowed."
             )
 
-        # Read file content to check size
-        content = await file.read()
-        file_size = len(content)
-        
-        # Validate file size (max 5MB)
-        if file_size > 5 * 1024 * 1024:
+        # Validate file size from the parsed upload, without reading it
+        if file.size is not None and file.size > ProfileService.MAX_PHOTO_SIZE:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File too large. Maximum size is 5MB."
+                detail=f"File too large. Maximum size is {ProfileService.MAX_PHOTO_SIZE // (1024 * 1024)}MB."
             )
 
-        # Reset file pointer and update file object
-        await file.seek(0)
-
         service = ProfileService(supabase)
         try:
             file_url = await service.upload_profile_photo(user_id, file)
@@ -0,0 +1,44 @@
+"""
+In-process TTL cache used by the services.
+
+Each worker process holds its own entries. A service's invalidate call only
+clears the current process; other workers see a change once their entry's
+TTL expires, so TTLs bound how stale a read can be across instances.
+"""
+
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Dict-backed cache whose entries expire after `ttl_seconds`, evicting oldest first when full"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.ttl_seconds:
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        # Re-insert so a refreshed key moves to the newest position
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            # Evict the oldest entry (dicts keep insertion order)
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic(), value)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one entry, or every entry when `key` is None"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
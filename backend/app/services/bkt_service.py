@@ -194,18 +194,18 @@ class BKTService:
         
         return response.data
     
-    async def initialize_skill_mastery(self, user_id: str, skill_id: str) -> Dict:
+    def build_default_mastery_row(self, user_id: str, skill_id: str) -> Dict:
         """
-        Initialize a new skill mastery record with default parameters.
+        Build a skill mastery row with default BKT parameters (not inserted).
         
         Args:
             user_id: Student ID
             skill_id: Topic/skill ID
             
         Returns:
-            Newly created mastery record
+            Mastery row ready for insert
         """
-        insert_data = {
+        return {
             "user_id": user_id,
             "skill_id": skill_id,
             "mastery_probability": self.DEFAULT_PRIOR,
@@ -217,6 +217,19 @@ class BKTService:
             "correct_attempts": 0,
             "plateau_flag": False
         }
+    
+    async def initialize_skill_mastery(self, user_id: str, skill_id: str) -> Dict:
+        """
+        Initialize a new skill mastery record with default parameters.
+        
+        Args:
+            user_id: Student ID
+            skill_id: Topic/skill ID
+            
+        Returns:
+            Newly created mastery record
+        """
+        insert_data = self.build_default_mastery_row(user_id, skill_id)
         
         response = self.db.table("user_skill_mastery").insert(insert_data).execute()
         return response.data[0]
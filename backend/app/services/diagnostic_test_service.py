@@ -1,9 +1,18 @@
+import asyncio
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, Tuple
 from supabase import Client
 import random
 from app.models.diagnostic_test import DiagnosticTestStatus, DiagnosticQuestionStatus
 from app.services.bkt_service import BKTService
+from app.services.sampling import sample_by_distribution
+
+
+def _chunked(items: List, size: int) -> Iterator[List]:
+    """Yield successive slices of at most `size` items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 class DiagnosticTestService:
@@ -17,6 +26,9 @@ class DiagnosticTestService:
     # Difficulty distribution (medium difficulty for baseline assessment)
     DIFFICULTY_DISTRIBUTION = {"E": 0.33, "M": 0.34, "H": 0.33}
 
+    # Max rows per insert request, kept well under PostgREST payload limits
+    INSERT_BATCH_SIZE = 500
+
     def __init__(self, db: Client):
         self.db = db
 
@@ -59,26 +71,6 @@ class DiagnosticTestService:
             section: Section type (math or reading_writing)
             num_questions: Number of questions to generate
         """
-        # Fetch all categories for this section
-        categories_response = (
-            self.db.table("categories")
-            .select("id, name, topics(id, name)")
-            .eq("section", section)
-            .execute()
-        )
-
-        if not categories_response.data:
-            raise ValueError(f"No categories found for section: {section}")
-
-        # Get all topics for this section
-        all_topics = []
-        for category in categories_response.data:
-            topics = category.get("topics", [])
-            all_topics.extend(topics)
-
-        if not all_topics:
-            raise ValueError(f"No topics found for section: {section}")
-
         # Fetch all active questions for this section, grouped by topic
         questions_response = (
             self.db.table("questions")
@@ -97,8 +89,8 @@ class DiagnosticTestService:
                     questions_by_topic[topic_id] = []
                 questions_by_topic[topic_id].append(q)
 
-        # Filter to topics that have questions available
-        available_topics = [t for t in all_topics if t["id"] in questions_by_topic]
+        # Topics that have questions available in this section
+        available_topics = list(questions_by_topic)
 
         if not available_topics:
             raise ValueError(f"No questions available for section: {section}")
@@ -110,8 +102,7 @@ class DiagnosticTestService:
         topics_to_cover = min(len(available_topics), num_questions)
         sampled_topics = random.sample(available_topics, topics_to_cover)
 
-        for topic in sampled_topics:
-            topic_id = topic["id"]
+        for topic_id in sampled_topics:
             available_questions = questions_by_topic[topic_id]
 
             if available_questions:
@@ -143,29 +134,9 @@ class DiagnosticTestService:
                 if difficulty in by_difficulty:
                     by_difficulty[difficulty].append(q)
 
-            # Select additional questions based on difficulty distribution
-            for difficulty, ratio in self.DIFFICULTY_DISTRIBUTION.items():
-                target_count = int(remaining_needed * ratio)
-                available = by_difficulty[difficulty]
-
-                if len(available) >= target_count:
-                    selected = random.sample(available, target_count)
-                else:
-                    selected = available
-
-                selected_questions.extend(selected)
-
-            # Fill any remaining slots
-            if len(selected_questions) < num_questions:
-                still_needed = num_questions - len(selected_questions)
-                selected_ids = {q["id"] for q in selected_questions}
-                final_pool = [q for q in remaining_pool if q["id"] not in selected_ids]
-
-                if final_pool:
-                    additional = random.sample(
-                        final_pool, min(still_needed, len(final_pool))
-                    )
-                    selected_questions.extend(additional)
+            selected_questions.extend(
+                sample_by_distribution(by_difficulty, self.DIFFICULTY_DISTRIBUTION, remaining_needed)
+            )
 
         # Shuffle questions for randomness
         random.shuffle(selected_questions)
@@ -185,8 +156,8 @@ class DiagnosticTestService:
             }
             batch_inserts.append(question_data)
 
-        if batch_inserts:
-            self.db.table("diagnostic_test_questions").insert(batch_inserts).execute()
+        for chunk in _chunked(batch_inserts, self.INSERT_BATCH_SIZE):
+            self.db.table("diagnostic_test_questions").insert(chunk).execute()
 
     async def start_test(self, test_id: str, user_id: str) -> Dict:
         """
@@ -252,38 +223,41 @@ class DiagnosticTestService:
         Returns:
             Tuple of (is_correct, correct_answer)
         """
-        # Verify test belongs to user
-        test_response = (
-            self.db.table("diagnostic_tests")
-            .select("*")
-            .eq("id", test_id)
-            .execute()
-        )
-
-        if not test_response.data:
-            raise ValueError("Test not found")
-
-        if test_response.data[0]["user_id"] != user_id:
-            raise PermissionError("Test does not belong to user")
-
-        # Get the diagnostic test question and actual question
+        # Get the diagnostic test question and actual question, scoped to the user's test
         dtq_response = (
             self.db.table("diagnostic_test_questions")
-            .select("*, questions(correct_answer, acceptable_answers)")
+            .select(
+                "*, questions(correct_answer, normalized_correct_answer, normalized_acceptable_answers), "
+                "diagnostic_tests!inner(user_id)"
+            )
             .eq("test_id", test_id)
             .eq("question_id", question_id)
+            .eq("diagnostic_tests.user_id", user_id)
             .execute()
         )
 
         if not dtq_response.data:
+            # Only on the miss path: work out which error to report
+            test_response = (
+                self.db.table("diagnostic_tests")
+                .select("user_id")
+                .eq("id", test_id)
+                .execute()
+            )
+
+            if not test_response.data:
+                raise ValueError("Test not found")
+
+            if test_response.data[0]["user_id"] != user_id:
+                raise PermissionError("Test does not belong to user")
+
             raise ValueError("Question not found in test")
 
         dtq = dtq_response.data[0]
         question = dtq["questions"]
 
-        # Check correctness
+        # Check correctness against answers normalized at write time
         correct_answer = question.get("correct_answer", [])
-        acceptable_answers = question.get("acceptable_answers", [])
 
         def normalize_answer(ans_list):
             if not ans_list:
@@ -291,13 +265,11 @@ class DiagnosticTestService:
             return [str(a).strip().lower() for a in ans_list]
 
         normalized_user = normalize_answer(user_answer)
-        normalized_correct = normalize_answer(correct_answer)
-        normalized_acceptable = normalize_answer(acceptable_answers) if acceptable_answers else []
+        normalized_correct = question.get("normalized_correct_answer") or []
+        acceptable_set = frozenset(question.get("normalized_acceptable_answers") or ())
 
-        is_correct = normalized_user == normalized_correct or (
-            normalized_acceptable
-            and len(normalized_user) > 0
-            and normalized_user[0] in normalized_acceptable
+        is_correct = normalized_user == normalized_correct or bool(
+            normalized_user and normalized_user[0] in acceptable_set
         )
 
         # Update diagnostic test question
@@ -324,14 +296,26 @@ class DiagnosticTestService:
         Returns:
             Completion summary with mastery initialization data
         """
-        # Verify test belongs to user
-        test_response = (
-            self.db.table("diagnostic_tests")
-            .select("*")
-            .eq("id", test_id)
-            .execute()
+        # Fetch the test, its questions with answers, and all topics concurrently
+        test_response, questions_response, all_topics_response = await asyncio.gather(
+            asyncio.to_thread(
+                lambda: self.db.table("diagnostic_tests")
+                .select("*")
+                .eq("id", test_id)
+                .execute()
+            ),
+            asyncio.to_thread(
+                lambda: self.db.table("diagnostic_test_questions")
+                .select("section, is_correct, questions(topic_id, topics(name))")
+                .eq("test_id", test_id)
+                .execute()
+            ),
+            asyncio.to_thread(
+                lambda: self.db.table("topics").select("id").execute()
+            ),
         )
 
+        # Verify test belongs to user
         if not test_response.data:
             raise ValueError("Test not found")
 
@@ -339,47 +323,47 @@ class DiagnosticTestService:
         if test["user_id"] != user_id:
             raise PermissionError("Test does not belong to user")
 
-        # Get all test questions with answers
-        questions_response = (
-            self.db.table("diagnostic_test_questions")
-            .select("*, questions(topic_id, topics(id, name))")
-            .eq("test_id", test_id)
-            .execute()
+        # Calculate overall, per-section and per-topic performance in one pass
+        total_correct = math_correct = rw_correct = 0
+        topic_performance = defaultdict(
+            lambda: {"topic_name": "Unknown", "correct": 0, "total": 0}
         )
-
-        # Calculate performance
-        total_correct = sum(1 for q in questions_response.data if q.get("is_correct") is True)
-
-        math_questions = [q for q in questions_response.data if q["section"] == "math"]
-        math_correct = sum(1 for q in math_questions if q.get("is_correct") is True)
-
-        rw_questions = [q for q in questions_response.data if q["section"] == "reading_writing"]
-        rw_correct = sum(1 for q in rw_questions if q.get("is_correct") is True)
-
-        # Group by topic and calculate per-topic performance
-        topic_performance = {}
         for q in questions_response.data:
+            is_correct = q.get("is_correct") is True
+            if is_correct:
+                total_correct += 1
+                if q["section"] == "math":
+                    math_correct += 1
+                elif q["section"] == "reading_writing":
+                    rw_correct += 1
+
             question_data = q.get("questions", {})
             topic_id = question_data.get("topic_id")
 
             if not topic_id:
                 continue
 
-            if topic_id not in topic_performance:
-                topic_info = question_data.get("topics", {})
-                topic_performance[topic_id] = {
-                    "topic_name": topic_info.get("name", "Unknown"),
-                    "correct": 0,
-                    "total": 0
-                }
+            perf = topic_performance[topic_id]
+            if perf["total"] == 0:
+                perf["topic_name"] = question_data.get("topics", {}).get("name", "Unknown")
 
-            topic_performance[topic_id]["total"] += 1
-            if q.get("is_correct"):
-                topic_performance[topic_id]["correct"] += 1
+            perf["total"] += 1
+            if is_correct:
+                perf["correct"] += 1
 
         # Initialize BKT mastery for each topic based on performance
         bkt_service = BKTService(self.db)
         mastery_updates = []
+        now_iso = datetime.utcnow().isoformat()
+
+        # Fetch the user's existing mastery records in one query
+        existing_response = (
+            self.db.table("user_skill_mastery")
+            .select("id, skill_id")
+            .eq("user_id", user_id)
+            .execute()
+        )
+        existing_by_skill = {e["skill_id"]: e["id"] for e in existing_response.data}
 
         for topic_id, perf in topic_performance.items():
             percentage_correct = perf["correct"] / perf["total"] if perf["total"] > 0 else 0
@@ -387,24 +371,24 @@ class DiagnosticTestService:
             # Adjust for guessing (P(G) = 0.25)
             # Formula: P(L0) = (observed - guess) / (1 - guess)
             adjusted_mastery = max(0.01, min(0.99, (percentage_correct - 0.25) / 0.75))
+            rounded_mastery = round(adjusted_mastery, 4)
 
-            # Check if mastery record already exists
-            existing_mastery = await bkt_service.get_user_mastery(user_id, topic_id)
+            existing_mastery_id = existing_by_skill.get(topic_id)
 
             mastery_data = {
                 "user_id": user_id,
                 "skill_id": topic_id,
-                "mastery_probability": round(adjusted_mastery, 4),
-                "prior_knowledge": round(adjusted_mastery, 4),
+                "mastery_probability": rounded_mastery,
+                "prior_knowledge": rounded_mastery,
                 "total_attempts": perf["total"],
                 "correct_attempts": perf["correct"],
-                "last_practiced_at": datetime.utcnow().isoformat()
+                "last_practiced_at": now_iso
             }
 
-            if existing_mastery:
+            if existing_mastery_id:
                 # Update existing record
                 self.db.table("user_skill_mastery").update(mastery_data).eq(
-                    "id", existing_mastery["id"]
+                    "id", existing_mastery_id
                 ).execute()
             else:
                 # Create new record with default BKT parameters
@@ -418,19 +402,19 @@ class DiagnosticTestService:
             mastery_updates.append({
                 "topic_id": topic_id,
                 "topic_name": perf["topic_name"],
-                "initial_mastery": round(adjusted_mastery, 4),
+                "initial_mastery": rounded_mastery,
                 "questions_answered": perf["total"],
                 "correct_answers": perf["correct"]
             })
 
         # Initialize any remaining topics with default prior if not covered in diagnostic
-        all_topics_response = self.db.table("topics").select("id").execute()
-        for topic in all_topics_response.data:
-            topic_id = topic["id"]
-            if topic_id not in topic_performance:
-                existing = await bkt_service.get_user_mastery(user_id, topic_id)
-                if not existing:
-                    await bkt_service.initialize_skill_mastery(user_id, topic_id)
+        default_rows = [
+            bkt_service.build_default_mastery_row(user_id, topic["id"])
+            for topic in all_topics_response.data
+            if topic["id"] not in topic_performance and topic["id"] not in existing_by_skill
+        ]
+        if default_rows:
+            self.db.table("user_skill_mastery").insert(default_rows).execute()
 
         # Update test record
         update_data = {
@@ -1,6 +1,9 @@
+import asyncio
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from supabase import Client
+from postgrest.exceptions import APIError
+import hashlib
 import random
 from app.models.mock_exam import (
     ModuleType,
@@ -8,7 +11,21 @@ from app.models.mock_exam import (
     ModuleStatus,
     MockQuestionStatus,
 )
+from app.core.cache import TTLCache
 from app.services.bkt_service import BKTService
+from app.services.sampling import sample_by_distribution
+
+
+def _scaled_score_table(total_questions: int) -> Tuple[int, ...]:
+    """
+    Precompute the scaled score (200-800) for every raw score 0..total_questions.
+    Uses simplified linear scaling and rounds to nearest 10.
+    """
+    table = []
+    for raw_score in range(total_questions + 1):
+        scaled = round((200 + raw_score / total_questions * 600) / 10) * 10
+        table.append(int(min(800, max(200, scaled))))
+    return tuple(table)
 
 
 class MockExamService:
@@ -16,6 +33,7 @@ class MockExamService:
 
     # SAT exam configuration constants
     QUESTIONS_PER_MODULE = 27
+    QUESTIONS_PER_SECTION = QUESTIONS_PER_MODULE * 2
     TIME_LIMIT_MINUTES = 32
 
     # Difficulty distribution for adaptive modules
@@ -23,9 +41,47 @@ class MockExamService:
     MEDIUM_DISTRIBUTION = {"E": 0.33, "M": 0.34, "H": 0.33}  # Balanced
     HARD_DISTRIBUTION = {"E": 0.15, "M": 0.35, "H": 0.5}  # Module 2 if did well
 
+    # Scaled section score indexed by raw score
+    SCALED_SCORES = _scaled_score_table(QUESTIONS_PER_SECTION)
+
+    # Section and adaptive follow-up for each module type (str enum keys also match raw values)
+    SECTION_BY_MODULE_TYPE = {
+        ModuleType.MATH_MODULE_1: "math",
+        ModuleType.MATH_MODULE_2: "math",
+        ModuleType.RW_MODULE_1: "reading_writing",
+        ModuleType.RW_MODULE_2: "reading_writing",
+    }
+    NEXT_MODULE_TYPE = {
+        ModuleType.MATH_MODULE_1: ModuleType.MATH_MODULE_2,
+        ModuleType.RW_MODULE_1: ModuleType.RW_MODULE_2,
+    }
+
+    # Categories and grouped question ids per section; refreshed every few minutes
+    # or via invalidate_pool
+    _section_pool_cache = TTLCache(ttl_seconds=300)
+
     def __init__(self, db: Client):
         self.db = db
 
+    async def _run(self, query):
+        """Execute a Supabase query builder off the event loop."""
+        return await asyncio.to_thread(query.execute)
+
+    async def _run_rpc(self, function_name: str, params: Dict):
+        """
+        Call a database function, mapping its not-found / not-owner errors
+        to ValueError / PermissionError like the rest of the service.
+        """
+        try:
+            response = await self._run(self.db.rpc(function_name, params))
+        except APIError as e:
+            if e.code == "P0002":
+                raise ValueError(e.message)
+            if e.code == "42501":
+                raise PermissionError(e.message)
+            raise
+        return response.data
+
     async def create_mock_exam(
         self, user_id: str, exam_type: str = "full_length"
     ) -> Dict:
@@ -46,12 +102,11 @@ class MockExamService:
             "status": MockExamStatus.NOT_STARTED.value,
         }
 
-        exam_response = self.db.table("mock_exams").insert(exam_data).execute()
+        exam_response = await self._run(self.db.table("mock_exams").insert(exam_data))
         exam = exam_response.data[0]
         exam_id = exam["id"]
 
         # Create 4 modules - Start with Reading/Writing as per SAT format
-        modules = []
         module_types = [
             (ModuleType.RW_MODULE_1, 1),
             (ModuleType.RW_MODULE_2, 2),
@@ -59,26 +114,31 @@ class MockExamService:
             (ModuleType.MATH_MODULE_2, 2),
         ]
 
-        for module_type, module_number in module_types:
-            module_data = {
+        modules_payload = [
+            {
                 "exam_id": exam_id,
                 "module_type": module_type.value,
                 "module_number": module_number,
                 "time_limit_minutes": self.TIME_LIMIT_MINUTES,
                 "status": ModuleStatus.NOT_STARTED.value,
             }
-            module_response = (
-                self.db.table("mock_exam_modules").insert(module_data).execute()
+            for module_type, module_number in module_types
+        ]
+        modules_response = await self._run(
+            self.db.table("mock_exam_modules").insert(modules_payload)
+        )
+        modules_by_type = {m["module_type"]: m for m in modules_response.data}
+        modules = [modules_by_type[module_type.value] for module_type, _ in module_types]
+
+        # Generate questions for module 1 of each section
+        # Module 2 questions will be generated after module 1 is completed (adaptive)
+        await asyncio.gather(*(
+            self._generate_module_questions(
+                modules_by_type[module_type.value]["id"], module_type, difficulty_level="medium"
             )
-            module = module_response.data[0]
-            modules.append(module)
-
-            # Generate questions for module 1 of each section
-            # Module 2 questions will be generated after module 1 is completed (adaptive)
-            if module_number == 1:
-                await self._generate_module_questions(
-                    module["id"], module_type, difficulty_level="medium"
-                )
+            for module_type, module_number in module_types
+            if module_number == 1
+        ))
 
         return {"exam": exam, "modules": modules}
 
@@ -97,7 +157,7 @@ class MockExamService:
             difficulty_level: Overall difficulty (easy, medium, hard) for adaptive testing
         """
         # Determine section type
-        section = "math" if "math" in module_type.value else "reading_writing"
+        section = self.SECTION_BY_MODULE_TYPE[module_type]
 
         # Select difficulty distribution
         if difficulty_level == "easy":
@@ -107,52 +167,20 @@ class MockExamService:
         else:
             distribution = self.MEDIUM_DISTRIBUTION
 
-        # Fetch categories with their weights for this section
-        categories_response = (
-            self.db.table("categories")
-            .select("id, name, weight_in_section, topics(id, name)")
-            .eq("section", section)
-            .execute()
+        # Seed from the module so a module's selection can be reproduced for debugging/audit
+        rng = random.Random(
+            int.from_bytes(hashlib.blake2b(module_id.encode(), digest_size=8).digest(), "little")
         )
 
-        if not categories_response.data:
-            raise ValueError(f"No categories found for section: {section}")
-
-        # Fetch all active questions for this section
-        # Filter by section through topics -> categories relationship
-        questions_response = (
-            self.db.table("questions")
-            .select("*, topics(id, category_id, categories(section))")
-            .eq("is_active", True)
-            .execute()
+        categories, questions_by_category = await asyncio.to_thread(
+            self._load_section_pool, section
         )
 
-        # Group questions by category and difficulty
-        # Structure: {category_id: {difficulty: [questions]}}
-        questions_by_category = {}
-        for q in questions_response.data:
-            topic = q.get("topics")
-            if not topic:
-                continue
-
-            # Filter by section - only include questions from the correct section
-            category = topic.get("categories")
-            if not category or category.get("section") != section:
-                continue
-
-            category_id = topic.get("category_id")
-            difficulty = q.get("difficulty")
-
-            if category_id not in questions_by_category:
-                questions_by_category[category_id] = {"E": [], "M": [], "H": []}
-
-            if difficulty in ["E", "M", "H"]:
-                questions_by_category[category_id][difficulty].append(q)
-
         # Select questions per category based on weights
         selected_questions = []
+        selected_ids = set()
 
-        for category in categories_response.data:
+        for category in categories:
             category_id = category["id"]
             category_weight = category["weight_in_section"] / 100.0
             category_target = int(self.QUESTIONS_PER_MODULE * category_weight)
@@ -164,59 +192,32 @@ class MockExamService:
             category_questions = questions_by_category.get(category_id, {"E": [], "M": [], "H": []})
 
             # Distribute questions within category by difficulty
-            category_selected = []
-            for difficulty, ratio in distribution.items():
-                difficulty_target = int(category_target * ratio)
-                available = category_questions[difficulty]
-
-                if len(available) >= difficulty_target:
-                    selected = random.sample(available, difficulty_target)
-                else:
-                    selected = available
-
-                category_selected.extend(selected)
-
-            # If we don't have enough for this category, fill from any available in category
-            if len(category_selected) < category_target:
-                remaining_needed = category_target - len(category_selected)
-                selected_ids = {q["id"] for q in category_selected}
-
-                # Pool all questions in category not yet selected
-                remaining_pool = []
-                for diff_questions in category_questions.values():
-                    for q in diff_questions:
-                        if q["id"] not in selected_ids:
-                            remaining_pool.append(q)
-
-                if remaining_pool:
-                    additional = random.sample(
-                        remaining_pool, min(remaining_needed, len(remaining_pool))
-                    )
-                    category_selected.extend(additional)
-
+            category_selected = sample_by_distribution(
+                category_questions, distribution, category_target, rng
+            )
             selected_questions.extend(category_selected)
+            selected_ids.update(q["id"] for q in category_selected)
 
         # If we still don't have enough questions total, fill from any available
         if len(selected_questions) < self.QUESTIONS_PER_MODULE:
             remaining_needed = self.QUESTIONS_PER_MODULE - len(selected_questions)
-            selected_ids = {q["id"] for q in selected_questions}
 
-            # Pool all available questions
-            all_questions = []
-            for cat_questions in questions_by_category.values():
-                for diff_questions in cat_questions.values():
-                    all_questions.extend(diff_questions)
-
-            remaining_pool = [q for q in all_questions if q["id"] not in selected_ids]
+            remaining_pool = [
+                q
+                for cat_questions in questions_by_category.values()
+                for diff_questions in cat_questions.values()
+                for q in diff_questions
+                if q["id"] not in selected_ids
+            ]
 
             if remaining_pool:
-                additional = random.sample(
+                additional = rng.sample(
                     remaining_pool, min(remaining_needed, len(remaining_pool))
                 )
                 selected_questions.extend(additional)
 
         # Shuffle questions for randomness
-        random.shuffle(selected_questions)
+        rng.shuffle(selected_questions)
 
         # Insert questions with display order
         batch_inserts = []
@@ -231,59 +232,91 @@ class MockExamService:
             batch_inserts.append(question_data)
 
         if batch_inserts:
-            self.db.table("mock_exam_questions").insert(batch_inserts).execute()
+            await self._run(self.db.table("mock_exam_questions").insert(batch_inserts))
 
-    async def start_module(self, module_id: str, user_id: str) -> Dict:
+    @classmethod
+    def invalidate_pool(cls, section: Optional[str] = None) -> None:
         """
-        Start a module, setting status and start time.
+        Drop cached question pools so the next exam sees question/category edits.
 
         Args:
-            module_id: Module ID to start
-            user_id: User ID starting the module
+            section: Section to invalidate, or None for all sections
+        """
+        cls._section_pool_cache.invalidate(section)
+
+    def _load_section_pool(self, section: str) -> Tuple[List[Dict], Dict[str, Dict[str, List[Dict]]]]:
+        """
+        Load a section's weighted categories and active questions grouped by category
+        and difficulty. Results are cached per section with a TTL.
+
+        Args:
+            section: Section type (math or reading_writing)
 
         Returns:
-            Updated module data
+            Tuple of (categories, {category_id: {difficulty: [questions]}})
         """
-        # Verify module belongs to user
-        module_response = (
-            self.db.table("mock_exam_modules")
-            .select("*, mock_exams!inner(user_id)")
-            .eq("id", module_id)
+        cached = self._section_pool_cache.get(section)
+        if cached is not None:
+            return cached
+
+        # Fetch categories with their weights for this section
+        categories_response = (
+            self.db.table("categories")
+            .select("id, weight_in_section")
+            .eq("section", section)
+            .order("id")
             .execute()
         )
 
-        if not module_response.data:
-            raise ValueError("Module not found")
-
-        module = module_response.data[0]
-        if module["mock_exams"]["user_id"] != user_id:
-            raise PermissionError("Module does not belong to user")
-
-        # Update module status
-        update_data = {
-            "status": ModuleStatus.IN_PROGRESS.value,
-            "started_at": datetime.utcnow().isoformat(),
-        }
+        if not categories_response.data:
+            raise ValueError(f"No categories found for section: {section}")
 
-        updated_module = (
-            self.db.table("mock_exam_modules")
-            .update(update_data)
-            .eq("id", module_id)
+        # Fetch only the columns selection needs, filtered to this section
+        # server-side through the topics -> categories relationship. Both queries
+        # are ordered so a module's seeded sampling sees the same pool order
+        questions_response = (
+            self.db.table("questions")
+            .select("id, difficulty, topics!inner(category_id, categories!inner(section))")
+            .eq("is_active", True)
+            .eq("topics.categories.section", section)
+            .order("id")
             .execute()
         )
 
-        # Update exam status if this is the first module
-        exam_id = module["exam_id"]
-        exam_response = self.db.table("mock_exams").select("*").eq("id", exam_id).execute()
-        exam = exam_response.data[0]
+        # Group questions by category and difficulty
+        # Structure: {category_id: {difficulty: [questions]}}
+        questions_by_category = {}
+        for q in questions_response.data:
+            category_id = q["topics"]["category_id"]
+            difficulty = q.get("difficulty")
 
-        if exam["status"] == MockExamStatus.NOT_STARTED.value:
-            self.db.table("mock_exams").update({
-                "status": MockExamStatus.IN_PROGRESS.value,
-                "started_at": datetime.utcnow().isoformat(),
-            }).eq("id", exam_id).execute()
+            if category_id not in questions_by_category:
+                questions_by_category[category_id] = {"E": [], "M": [], "H": []}
+
+            if difficulty in ["E", "M", "H"]:
+                questions_by_category[category_id][difficulty].append(
+                    {"id": q["id"], "difficulty": difficulty, "category_id": category_id}
+                )
 
-        return updated_module.data[0]
+        self._section_pool_cache.set(section, (categories_response.data, questions_by_category))
+        return categories_response.data, questions_by_category
+
+    async def start_module(self, module_id: str, user_id: str) -> Dict:
+        """
+        Start a module, setting status and start time.
+
+        Args:
+            module_id: Module ID to start
+            user_id: User ID starting the module
+
+        Returns:
+            Updated module data
+        """
+        # Ownership check, module update and exam status bump happen in one call
+        return await self._run_rpc(
+            "start_mock_exam_module",
+            {"p_module_id": module_id, "p_user_id": user_id},
+        )
 
     async def complete_module(
         self, module_id: str, user_id: str, time_remaining_seconds: Optional[int] = None
@@ -299,45 +332,20 @@ class MockExamService:
         Returns:
             Completed module with score
         """
-        # Verify module belongs to user
-        module_response = (
-            self.db.table("mock_exam_modules")
-            .select("*, mock_exams!inner(user_id, id)")
-            .eq("id", module_id)
-            .execute()
+        # Ownership check, raw score, module update and all-completed check in one call
+        result = await self._run_rpc(
+            "complete_mock_exam_module",
+            {
+                "p_module_id": module_id,
+                "p_user_id": user_id,
+                "p_time_remaining_seconds": time_remaining_seconds,
+            },
         )
-
-        if not module_response.data:
-            raise ValueError("Module not found")
-
-        module = module_response.data[0]
-        if module["mock_exams"]["user_id"] != user_id:
-            raise PermissionError("Module does not belong to user")
-
-        # Calculate raw score (count correct answers)
-        questions_response = (
-            self.db.table("mock_exam_questions")
-            .select("*")
-            .eq("module_id", module_id)
-            .execute()
-        )
-
-        correct_count = sum(
-            1 for q in questions_response.data if q.get("is_correct") is True
-        )
-
-        # Update module
-        update_data = {
-            "status": ModuleStatus.COMPLETED.value,
-            "completed_at": datetime.utcnow().isoformat(),
-            "raw_score": correct_count,
-            "time_remaining_seconds": time_remaining_seconds,
-        }
-
-        self.db.table("mock_exam_modules").update(update_data).eq("id", module_id).execute()
+        module = result["module"]
+        correct_count = module["raw_score"]
 
         # If this is module 1, generate adaptive questions for module 2
-        exam_id = module["mock_exams"]["id"]
+        exam_id = module["exam_id"]
         module_type = module["module_type"]
         module_number = module["module_number"]
 
@@ -352,39 +360,24 @@ class MockExamService:
                 next_difficulty = "easy"
 
             # Get module 2 of same section
-            section_prefix = "math" if "math" in module_type else "rw"
-            next_module_type = f"{section_prefix}_module_2"
+            next_module_type = self.NEXT_MODULE_TYPE[module_type]
 
-            next_module_response = (
+            next_module_response = await self._run(
                 self.db.table("mock_exam_modules")
                 .select("*")
                 .eq("exam_id", exam_id)
-                .eq("module_type", next_module_type)
-                .execute()
+                .eq("module_type", next_module_type.value)
             )
 
             if next_module_response.data:
                 next_module = next_module_response.data[0]
                 await self._generate_module_questions(
                     next_module["id"],
-                    ModuleType(next_module_type),
+                    next_module_type,
                     difficulty_level=next_difficulty,
                 )
 
-        # Check if all modules are completed
-        all_modules_response = (
-            self.db.table("mock_exam_modules")
-            .select("*")
-            .eq("exam_id", exam_id)
-            .execute()
-        )
-
-        all_completed = all(
-            m["status"] == ModuleStatus.COMPLETED.value
-            for m in all_modules_response.data
-        )
-
-        if all_completed:
+        if result["all_completed"]:
             await self._finalize_exam(exam_id, user_id)
 
         return module
@@ -397,30 +390,15 @@ class MockExamService:
             exam_id: Exam ID to finalize
             user_id: User ID who took the exam
         """
-        # Get all modules
-        modules_response = (
-            self.db.table("mock_exam_modules")
-            .select("*")
-            .eq("exam_id", exam_id)
-            .execute()
-        )
-
-        # Calculate section scores
-        math_raw = sum(
-            m["raw_score"] or 0
-            for m in modules_response.data
-            if "math" in m["module_type"]
-        )
-        rw_raw = sum(
-            m["raw_score"] or 0
-            for m in modules_response.data
-            if "rw" in m["module_type"]
-        )
+        # Calculate section raw scores in the database
+        raw_scores = await self._run_rpc("get_mock_exam_raw_scores", {"p_exam_id": exam_id})
+        math_raw = raw_scores["math_raw"]
+        rw_raw = raw_scores["rw_raw"]
 
         # Convert raw scores to scaled scores (simplified linear scaling)
         # Real SAT uses complex equating, but this is a reasonable approximation
-        math_score = self._convert_to_scaled_score(math_raw, self.QUESTIONS_PER_MODULE * 2)
-        rw_score = self._convert_to_scaled_score(rw_raw, self.QUESTIONS_PER_MODULE * 2)
+        math_score = self._convert_to_scaled_score(math_raw)
+        rw_score = self._convert_to_scaled_score(rw_raw)
         total_score = math_score + rw_score
 
         # Update skill mastery based on exam performance
@@ -439,7 +417,7 @@ class MockExamService:
             "total_score": total_score,
         }
 
-        self.db.table("mock_exams").update(update_data).eq("id", exam_id).execute()
+        await self._run(self.db.table("mock_exams").update(update_data).eq("id", exam_id))
 
     async def _update_mastery_from_exam(self, exam_id: str, user_id: str) -> None:
         """
@@ -452,9 +430,9 @@ class MockExamService:
             user_id: User ID who took the exam
         """
         # Get all modules for this exam
-        modules_response = self.db.table("mock_exam_modules").select("id").eq(
+        modules_response = await self._run(self.db.table("mock_exam_modules").select("id").eq(
             "exam_id", exam_id
-        ).execute()
+        ))
 
         if not modules_response.data:
             return
@@ -462,9 +440,9 @@ class MockExamService:
         module_ids = [m["id"] for m in modules_response.data]
 
         # Fetch all answered questions with topic info
-        questions_response = self.db.table("mock_exam_questions").select(
+        questions_response = await self._run(self.db.table("mock_exam_questions").select(
             "is_correct, questions(topic_id)"
-        ).in_("module_id", module_ids).execute()
+        ).in_("module_id", module_ids))
 
         if not questions_response.data:
             return
@@ -492,14 +470,12 @@ class MockExamService:
                 print(f"[MOCK EXAM ERROR] Failed to process question: {e}")
                 continue
 
-    def _convert_to_scaled_score(self, raw_score: int, total_questions: int) -> int:
+    def _convert_to_scaled_score(self, raw_score: int) -> int:
         """
-        Convert raw score to SAT scaled score (200-800).
-        Uses simplified linear scaling and rounds to nearest 10.
+        Convert a section raw score to SAT scaled score (200-800).
 
         Args:
-            raw_score: Number of correct answers
-            total_questions: Total questions in section
+            raw_score: Number of correct answers in the section
 
         Returns:
             Scaled score between 200 and 800 (rounded to nearest 10)
@@ -507,12 +483,7 @@ class MockExamService:
         if raw_score <= 0:
             return 200
 
-        percentage = raw_score / total_questions
-        # Linear scale from 200 to 800
-        scaled = 200 + (percentage * 600)
-        # Round to nearest 10
-        scaled = round(scaled / 10) * 10
-        return int(min(800, max(200, scaled)))
+        return self.SCALED_SCORES[min(raw_score, self.QUESTIONS_PER_SECTION)]
 
     async def submit_answer(
         self,
@@ -537,38 +508,39 @@ class MockExamService:
         Returns:
             Tuple of (is_correct, correct_answer)
         """
-        # Verify module belongs to user
-        module_response = (
-            self.db.table("mock_exam_modules")
-            .select("*, mock_exams!inner(user_id)")
-            .eq("id", module_id)
-            .execute()
-        )
-
-        if not module_response.data:
-            raise ValueError("Module not found")
-
-        if module_response.data[0]["mock_exams"]["user_id"] != user_id:
-            raise PermissionError("Module does not belong to user")
-
-        # Get the mock exam question and actual question
-        meq_response = (
+        # Get the mock exam question and actual question, scoped to the user's exam
+        meq_response = await self._run(
             self.db.table("mock_exam_questions")
-            .select("*, questions(correct_answer, acceptable_answers)")
+            .select(
+                "*, questions(correct_answer, normalized_correct_answer, normalized_acceptable_answers), "
+                "mock_exam_modules!inner(mock_exams!inner(user_id))"
+            )
             .eq("module_id", module_id)
             .eq("question_id", question_id)
-            .execute()
+            .eq("mock_exam_modules.mock_exams.user_id", user_id)
         )
 
         if not meq_response.data:
+            # Only on the miss path: work out which error to report
+            module_response = await self._run(
+                self.db.table("mock_exam_modules")
+                .select("mock_exams!inner(user_id)")
+                .eq("id", module_id)
+            )
+
+            if not module_response.data:
+                raise ValueError("Module not found")
+
+            if module_response.data[0]["mock_exams"]["user_id"] != user_id:
+                raise PermissionError("Module does not belong to user")
+
             raise ValueError("Question not found in module")
 
         meq = meq_response.data[0]
         question = meq["questions"]
 
-        # Check correctness
+        # Check correctness against answers normalized at write time
         correct_answer = question.get("correct_answer", [])
-        acceptable_answers = question.get("acceptable_answers", [])
 
         def normalize_answer(ans_list):
             if not ans_list:
@@ -576,13 +548,11 @@ class MockExamService:
             return [str(a).strip().lower() for a in ans_list]
 
         normalized_user = normalize_answer(user_answer)
-        normalized_correct = normalize_answer(correct_answer)
-        normalized_acceptable = normalize_answer(acceptable_answers) if acceptable_answers else []
+        normalized_correct = question.get("normalized_correct_answer") or []
+        acceptable_set = frozenset(question.get("normalized_acceptable_answers") or ())
 
-        is_correct = normalized_user == normalized_correct or (
-            normalized_acceptable
-            and len(normalized_user) > 0
-            and normalized_user[0] in normalized_acceptable
+        is_correct = normalized_user == normalized_correct or bool(
+            normalized_user and normalized_user[0] in acceptable_set
         )
 
         # Update mock exam question
@@ -594,6 +564,6 @@ class MockExamService:
             "answered_at": datetime.utcnow().isoformat(),
         }
 
-        self.db.table("mock_exam_questions").update(update_data).eq("id", meq["id"]).execute()
+        await self._run(self.db.table("mock_exam_questions").update(update_data).eq("id", meq["id"]))
 
         return is_correct, correct_answer
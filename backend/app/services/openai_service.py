@@ -1,18 +1,143 @@
-from openai import OpenAI
+from openai import AsyncOpenAI
 from app.config import get_settings
-from typing import Dict, List, Any, Optional
-import json
+from app.core.cache import TTLCache
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
+import hashlib
+import logging
+import orjson
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_FEEDBACK_SYSTEM_PROMPT = """You are an expert SAT tutor who provides clear, concise, and encouraging feedback to help students improve.
+
+Each user message is a JSON object describing one answered question:
+- "topic": question topic
+- "type": "mc" (multiple choice) or "spr" (student produced response)
+- "stem": question text
+- "correct": correct answer(s)
+- "user": the student's answer(s); empty if no answer was given
+- "is_correct": whether the student's answer was correct
+- "rationale": official rationale, if available
+- "perf": the student's record on this topic as {"topic_correct", "topic_total"}, if available
+
+Always respond with valid JSON in the following format:
+{
+    "explanation": "A clear, concise explanation of why the answer is correct/incorrect. Focus on the reasoning and concepts.",
+    "hints": ["Hint 1", "Hint 2", "Hint 3"],
+    "learning_points": ["Key concept 1", "Key concept 2", "Key concept 3"],
+    "key_concepts": ["Concept name 1", "Concept name 2"]
+}
+
+Guidelines:
+1. **Explanation**: If correct, explain why the student's approach was correct and reinforce the concept. If incorrect, identify where the student went wrong without giving away the full solution. Be encouraging.
+2. **Hints**: If correct, provide 2-3 additional insights or related concepts to strengthen understanding. If incorrect, provide 3-4 strategic hints to guide the student toward the correct approach.
+3. **Learning Points**: List 3-4 key takeaways the student should remember for similar questions.
+4. **Key Concepts**: List 2-3 SAT concepts/topics covered in this question.
+
+Be supportive, educational, and concise. Use language appropriate for high school students."""
+
+_CHAT_SYSTEM_PROMPT = """You are a helpful AI study assistant. You help students with homework, explain concepts, create study plans, and prepare for exams.
+
+Guidelines:
+- Be encouraging and supportive
+- Explain concepts clearly and step by step
+- Use examples when helpful
+- Keep responses concise but comprehensive
+- Focus on understanding rather than just answers
+- Be conversational and friendly
+
+If asked about inappropriate content, politely redirect to educational topics."""
+
+
+class _TopLevelFieldScanner:
+    """
+    Incrementally scan a streamed JSON object and emit each top-level
+    field as soon as its value is complete.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = None
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        self.buffer += text
+        completed = []
+        while self.pos < len(self.buffer):
+            ch = self.buffer[self.pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.member_start = self.pos + 1
+            elif ch in "}]" or (ch == "," and self.depth == 1):
+                if self.depth == 1 and self.member_start is not None:
+                    member = self.buffer[self.member_start:self.pos].strip()
+                    if member:
+                        try:
+                            completed.extend(orjson.loads("{" + member + "}").items())
+                        except orjson.JSONDecodeError:
+                            pass
+                    self.member_start = self.pos + 1
+                if ch != ",":
+                    self.depth -= 1
+            self.pos += 1
+        return completed
 
 
 class OpenAIService:
     """Service for generating AI-powered feedback using OpenAI API"""
-    
+
     def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key)
+        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
         self.model = settings.openai_model
         self.max_tokens = settings.openai_max_tokens
+        # Many students submit the same answer to the same question, so reuse feedback
+        self._feedback_cache = TTLCache(ttl_seconds=86400)
+
+    def _feedback_cache_key(
+        self,
+        question_id: Optional[str],
+        question_stem: str,
+        question_type: str,
+        correct_answer: List[str],
+        user_answer: List[str],
+        is_correct: bool,
+        topic_name: str,
+        user_performance_context: Dict[str, Any]
+    ) -> str:
+        """
+        Hash the inputs that shape feedback; performance is bucketed coarsely.
+
+        Reading and Writing stems are often the same generic prompt with the
+        passage stored separately, so the question itself must be part of the key.
+        """
+        perf_bucket = "none"
+        if user_performance_context:
+            topic_total = user_performance_context.get('topic_total', 0)
+            if topic_total > 0:
+                pct = user_performance_context.get('topic_correct', 0) / topic_total
+                perf_bucket = "low" if pct < 0.5 else "mid" if pct < 0.8 else "high"
+
+        answer_key = "/".join(str(a) for a in user_answer) if user_answer else ""
+        correct_key = "/".join(str(a) for a in correct_answer) if correct_answer else ""
+        raw_key = "|".join((
+            question_id or "", question_type, topic_name, correct_key,
+            question_stem, str(is_correct), answer_key, perf_bucket,
+        ))
+        return hashlib.sha256(raw_key.encode()).hexdigest()
     
     def _build_feedback_prompt(
         self,
@@ -25,58 +150,36 @@ class OpenAIService:
         topic_name: str,
         user_performance_context: Dict[str, Any]
     ) -> str:
-        """Build a comprehensive prompt for feedback generation"""
+        """Build the per-question user message; static instructions live in the system prompt"""
         
-        # Format answers for display
-        correct_answer_str = ", ".join(str(a) for a in correct_answer)
-        user_answer_str = ", ".join(str(a) for a in user_answer) if user_answer else "No answer provided"
-        
-        # Build performance context string
-        perf_context = ""
-        if user_performance_context:
-            topic_correct = user_performance_context.get('topic_correct', 0)
-            topic_total = user_performance_context.get('topic_total', 0)
-            if topic_total > 0:
-                perf_context = f"\n\nStudent's Performance Context:\n- This topic ({topic_name}): {topic_correct}/{topic_total} correct ({int(topic_correct/topic_total*100)}%)"
+        payload = {
+            "topic": topic_name,
+            "type": question_type,
+            "stem": question_stem,
+            "correct": correct_answer,
+            "user": user_answer or [],
+            "is_correct": is_correct,
+        }
+        if rationale:
+            payload["rationale"] = rationale
+        if user_performance_context and user_performance_context.get('topic_total', 0) > 0:
+            payload["perf"] = {
+                "topic_correct": user_performance_context.get('topic_correct', 0),
+                "topic_total": user_performance_context['topic_total'],
+            }
         
-        prompt = f"""You are an expert SAT tutor providing personalized feedback to help students improve.
-
-Question Topic: {topic_name}
-Question Type: {"Multiple Choice" if question_type == "mc" else "Student Produced Response"}
-
-Question:
-{question_stem}
-
-Correct Answer: {correct_answer_str}
-Student's Answer: {user_answer_str}
-Result: {"Correct ✓" if is_correct else "Incorrect ✗"}
-{perf_context}
-
-{"Official Rationale: " + rationale if rationale else ""}
-
-Please provide feedback in the following JSON format:
-{{
-    "explanation": "A clear, concise explanation of why the answer is correct/incorrect. Focus on the reasoning and concepts.",
-    "hints": ["Hint 1", "Hint 2", "Hint 3"],
-    "learning_points": ["Key concept 1", "Key concept 2", "Key concept 3"],
-    "key_concepts": ["Concept name 1", "Concept name 2"]
-}}
-
-Guidelines:
-1. **Explanation**: {"Explain why the student's approach was correct and reinforce the concept." if is_correct else "Identify where the student went wrong without giving away the full solution. Be encouraging."}
-2. **Hints**: {"Provide 2-3 additional insights or related concepts to strengthen understanding." if is_correct else "Provide 3-4 strategic hints to guide the student toward the correct approach."}
-3. **Learning Points**: List 3-4 key takeaways the student should remember for similar questions.
-4. **Key Concepts**: List 2-3 SAT concepts/topics covered in this question.
-
-Be supportive, educational, and concise. Use language appropriate for high school students."""
-
-        return prompt
+        return orjson.dumps(payload).decode()
     
-    def _parse_feedback_response(self, response_text: str) -> Dict[str, Any]:
-        """Parse the OpenAI response into structured feedback"""
+    def _parse_feedback_response(self, response_text: str) -> Tuple[Dict[str, Any], bool]:
+        """
+        Parse the OpenAI response into structured feedback.
+
+        Returns (feedback, parsed); parsed is False when the text wasn't valid
+        JSON and the feedback is the truncated-text fallback.
+        """
         try:
             # Try to parse as JSON
-            feedback = json.loads(response_text)
+            feedback = orjson.loads(response_text)
             
             # Validate required fields
             required_fields = ['explanation', 'hints', 'learning_points', 'key_concepts']
@@ -89,15 +192,15 @@ Be supportive, educational, and concise. Use language appropriate for high schoo
                 if not isinstance(feedback[field], list):
                     feedback[field] = [str(feedback[field])]
             
-            return feedback
-        except json.JSONDecodeError:
+            return feedback, True
+        except orjson.JSONDecodeError:
             # Fallback if JSON parsing fails
             return {
                 "explanation": response_text[:300] + "..." if len(response_text) > 300 else response_text,
                 "hints": [],
                 "learning_points": [],
                 "key_concepts": []
-            }
+            }, False
     
     async def generate_answer_feedback(
         self,
@@ -108,9 +211,18 @@ Be supportive, educational, and concise. Use language appropriate for high schoo
         is_correct: bool,
         rationale: Optional[str],
         topic_name: str,
-        user_performance_context: Dict[str, Any]
+        user_performance_context: Dict[str, Any],
+        question_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """Generate personalized feedback using OpenAI"""
+
+        cache_key = self._feedback_cache_key(
+            question_id, question_stem, question_type, correct_answer,
+            user_answer, is_correct, topic_name, user_performance_context
+        )
+        cached = self._feedback_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # Build the prompt
         prompt = self._build_feedback_prompt(
@@ -121,38 +233,119 @@ Be supportive, educational, and concise. Use language appropriate for high schoo
         
         # Call OpenAI API
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert SAT tutor who provides clear, concise, and encouraging feedback. Always respond with valid JSON."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                messages=self._feedback_messages(prompt),
                 temperature=0.7,
                 max_tokens=self.max_tokens,
                 response_format={"type": "json_object"}
             )
             
             # Parse and return feedback
-            feedback_text = response.choices[0].message.content
-            feedback = self._parse_feedback_response(feedback_text)
+            choice = response.choices[0]
+            feedback, parsed = self._parse_feedback_response(choice.message.content)
+            # Only complete, well-formed feedback is shared with other students
+            if parsed and choice.finish_reason == "stop":
+                self._feedback_cache.set(cache_key, feedback)
             
             return feedback
             
         except Exception as e:
             # Return error feedback if API call fails
-            print(f"OpenAI API Error: {str(e)}")
-            return {
-                "explanation": f"Unable to generate AI feedback at this time. {str(e)[:100]}",
-                "hints": [],
-                "learning_points": [],
-                "key_concepts": []
+            logger.exception("OpenAI feedback request failed")
+            return self._error_feedback(e)
+
+    async def stream_answer_feedback(
+        self,
+        question_stem: str,
+        question_type: str,
+        correct_answer: List[str],
+        user_answer: List[str],
+        is_correct: bool,
+        rationale: Optional[str],
+        topic_name: str,
+        user_performance_context: Dict[str, Any],
+        question_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream personalized feedback as it is generated.
+
+        Yields {"type": "field", "name": ..., "value": ...} as each top-level
+        feedback field completes, then {"type": "done", "feedback": ...} with the
+        validated feedback (same shape as generate_answer_feedback).
+        """
+
+        cache_key = self._feedback_cache_key(
+            question_id, question_stem, question_type, correct_answer,
+            user_answer, is_correct, topic_name, user_performance_context
+        )
+        cached = self._feedback_cache.get(cache_key)
+        if cached is not None:
+            for name, value in cached.items():
+                yield {"type": "field", "name": name, "value": value}
+            yield {"type": "done", "feedback": cached}
+            return
+
+        prompt = self._build_feedback_prompt(
+            question_stem, question_type, correct_answer,
+            user_answer, is_correct, rationale, topic_name,
+            user_performance_context
+        )
+
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=self._feedback_messages(prompt),
+                temperature=0.7,
+                max_tokens=self.max_tokens,
+                response_format={"type": "json_object"},
+                stream=True
+            )
+
+            scanner = _TopLevelFieldScanner()
+            finish_reason = None
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                if chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                for name, value in scanner.feed(delta):
+                    yield {"type": "field", "name": name, "value": value}
+
+            feedback, parsed = self._parse_feedback_response(scanner.buffer)
+            # Only cache output that finished normally and parsed as JSON
+            if parsed and finish_reason == "stop":
+                self._feedback_cache.set(cache_key, feedback)
+
+        except Exception as e:
+            logger.exception("OpenAI feedback stream failed")
+            feedback = self._error_feedback(e)
+
+        yield {"type": "done", "feedback": feedback}
+
+    def _feedback_messages(self, prompt: str) -> List[Dict[str, str]]:
+        return [
+            {
+                "role": "system",
+                "content": _FEEDBACK_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": prompt
             }
+        ]
+
+    def _error_feedback(self, error: Exception) -> Dict[str, Any]:
+        # Return error feedback if API call fails
+        return {
+            "explanation": f"Unable to generate AI feedback at this time. {str(error)[:100]}",
+            "hints": [],
+            "learning_points": [],
+            "key_concepts": []
+        }
 
     async def generate_chat_response(
         self,
@@ -165,17 +358,7 @@ Be supportive, educational, and concise. Use language appropriate for high schoo
         messages = [
             {
                 "role": "system",
-                "content": """You are a helpful AI study assistant. You help students with homework, explain concepts, create study plans, and prepare for exams.
-
-Guidelines:
-- Be encouraging and supportive
-- Explain concepts clearly and step by step
-- Use examples when helpful
-- Keep responses concise but comprehensive
-- Focus on understanding rather than just answers
-- Be conversational and friendly
-
-If asked about inappropriate content, politely redirect to educational topics."""
+                "content": _CHAT_SYSTEM_PROMPT
             }
         ]
 
@@ -190,7 +373,7 @@ If asked about inappropriate content, politely redirect to educational topics.""
         })
 
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=0.7,
@@ -24,11 +24,14 @@ class PracticeSessionService:
             Session data if verification succeeds
 
         Raises:
-            HTTPException: If session not found or doesn't belong to user
+            HTTPException: 404 if the session is missing or belongs to another user
+                (previously 403 for another user's session)
         """
+        # Ownership is filtered in the query (and by RLS on practice_sessions), so
+        # another user's session is indistinguishable from a missing one
         session_response = self.db.table("practice_sessions").select(
             "*, study_plans!inner(user_id)"
-        ).eq("id", session_id).execute()
+        ).eq("id", session_id).eq("study_plans.user_id", user_id).execute()
 
         if not session_response.data:
             raise HTTPException(
@@ -36,14 +39,7 @@ class PracticeSessionService:
                 detail="Session not found"
             )
 
-        session = session_response.data[0]
-        if session["study_plans"]["user_id"] != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this session"
-            )
-
-        return session
+        return session_response.data[0]
 
     def get_topic_performance(self, topic_id: str, user_id: str) -> Dict[str, int]:
         """
@@ -56,25 +52,13 @@ class PracticeSessionService:
         Returns:
             Dictionary with topic_correct and topic_total counts
         """
-        # Get all questions for this topic across user's sessions
-        topic_performance = self.db.table("session_questions").select(
-            "status, user_answer, questions(correct_answer, topic_id), "
-            "practice_sessions!inner(study_plans!inner(user_id))"
-        ).eq("topic_id", topic_id).execute()
-
-        # Filter to only this user's data
-        user_questions = [
-            q for q in topic_performance.data
-            if q["practice_sessions"]["study_plans"]["user_id"] == user_id
-        ]
-
-        topic_correct = sum(
-            1 for q in user_questions
-            if q["status"] == "answered" and q.get("user_answer") == q["questions"]["correct_answer"]
-        )
-        topic_total = len([q for q in user_questions if q["status"] == "answered"])
+        # Aggregate this user's answered questions for the topic in the database
+        response = self.db.rpc(
+            "get_topic_performance",
+            {"p_topic_id": topic_id, "p_user_id": user_id}
+        ).execute()
 
         return {
-            "topic_correct": topic_correct,
-            "topic_total": topic_total
+            "topic_correct": response.data["topic_correct"],
+            "topic_total": response.data["topic_total"]
         }
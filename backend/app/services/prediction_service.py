@@ -6,17 +6,38 @@ for the cognition business analytics.
 """
 
 from typing import Dict, List, Any, Optional, Tuple
-from datetime import datetime, timedelta
+import asyncio
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import logging
 import statistics
 from supabase import Client
 
+from app.core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=4096)
+def _parse_timestamp(value: str) -> datetime:
+    """Parse a PostgREST timestamp; snapshots are re-read on every dashboard load"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
 
 class PredictionService:
     """Service for calculating predictive SAT score analytics"""
     
+    # Latest result per user, tagged with the inputs' version; a version mismatch
+    # (new snapshot, plan edit or new day) forces a recompute
+    _prediction_cache = TTLCache(ttl_seconds=86400)
+    
     def __init__(self, db: Client):
         self.db = db
     
+    async def _run(self, query):
+        """Execute a Supabase query builder off the event loop."""
+        return await asyncio.to_thread(query.execute)
+    
     async def calculate_predictive_scores(self, user_id: str) -> Dict[str, Any]:
         """
         Calculate predictive SAT scores with trajectory and goal tracking.
@@ -25,18 +46,24 @@ class PredictionService:
             Dict containing current scores, predictions, and goal analysis
         """
         try:
-            # Get historical performance snapshots
-            snapshots = await self._get_snapshots_last_90_days(user_id)
+            version = await self._get_prediction_version(user_id)
+            cached = self._prediction_cache.get(user_id)
+            if cached is not None and cached[0] == version:
+                return cached[1]
             
-            # Get active study plan for goals
-            study_plan = await self._get_active_study_plan(user_id)
+            # Get historical performance snapshots and the active study plan for goals
+            snapshots, study_plan = await asyncio.gather(
+                self._get_snapshots_last_90_days(user_id),
+                self._get_active_study_plan(user_id)
+            )
             
             # Calculate current scores
             current_scores = self._get_current_scores(snapshots, study_plan)
             
             # Calculate trends using linear regression
-            math_trend = self._calculate_trend(snapshots, "predicted_sat_math")
-            rw_trend = self._calculate_trend(snapshots, "predicted_sat_rw")
+            trends = self._calculate_trends(snapshots, ["predicted_sat_math", "predicted_sat_rw"])
+            math_trend = trends["predicted_sat_math"]
+            rw_trend = trends["predicted_sat_rw"]
             
             # Calculate predictions for different time horizons
             predictions = self._calculate_predictions(
@@ -53,7 +80,7 @@ class PredictionService:
                 current_scores, math_trend, rw_trend, 12  # 12 weeks
             )
             
-            return {
+            result = {
                 "current_math": current_scores["math"],
                 "current_rw": current_scores["rw"],
                 "current_total": current_scores["total"],
@@ -71,27 +98,47 @@ class PredictionService:
                 "recommendations": goal_analysis["recommendations"]
             }
             
-        except Exception as e:
-            print(f"Error calculating predictive scores: {e}")
+            self._prediction_cache.set(user_id, (version, result))
+            
+            return result
+            
+        except Exception:
+            logger.exception("Error calculating predictive scores for user %s", user_id)
             return self._get_default_prediction_data()
     
+    async def _get_prediction_version(self, user_id: str) -> Tuple:
+        """Get the inputs' freshness key: today, newest snapshot, and active plan version"""
+        snapshot_result, plan_result = await asyncio.gather(
+            self._run(self.db.table("user_performance_snapshots").select(
+                "created_at"
+            ).eq("user_id", user_id).order("created_at", desc=True).limit(1)),
+            self._run(self.db.table("study_plans").select(
+                "id, updated_at"
+            ).eq("user_id", user_id).eq("is_active", True))
+        )
+        
+        latest_snapshot = snapshot_result.data[0]["created_at"] if snapshot_result.data else None
+        plan = plan_result.data[0] if plan_result.data else {}
+        
+        return (date.today(), latest_snapshot, plan.get("id"), plan.get("updated_at"))
+    
     async def _get_snapshots_last_90_days(self, user_id: str) -> List[Dict]:
         """Get performance snapshots from the last 90 days"""
         cutoff_date = (datetime.now() - timedelta(days=90)).isoformat()
         
-        result = self.db.table("user_performance_snapshots").select(
+        result = await self._run(self.db.table("user_performance_snapshots").select(
             "predicted_sat_math, predicted_sat_rw, created_at, snapshot_type"
         ).eq("user_id", user_id).gte("created_at", cutoff_date).order(
             "created_at", desc=False
-        ).execute()
+        ))
         
         return result.data if result.data else []
     
     async def _get_active_study_plan(self, user_id: str) -> Optional[Dict]:
         """Get the user's active study plan"""
-        result = self.db.table("study_plans").select(
+        result = await self._run(self.db.table("study_plans").select(
             "target_math_score, target_rw_score, current_math_score, current_rw_score, test_date, start_date"
-        ).eq("user_id", user_id).eq("is_active", True).execute()
+        ).eq("user_id", user_id).eq("is_active", True))
         
         return result.data[0] if result.data else None
     
@@ -121,49 +168,59 @@ class PredictionService:
             "total": math + rw
         }
     
-    def _calculate_trend(self, snapshots: List[Dict], score_field: str) -> Dict[str, float]:
+    def _calculate_trends(self, snapshots: List[Dict], score_fields: List[str]) -> Dict[str, Dict[str, float]]:
         """
-        Calculate linear regression trend for a score field.
-        Returns slope (points per week) and R-squared.
+        Calculate linear regression trends for several score fields at once.
+        The weeks axis is shared, so timestamps are parsed a single time.
+        Returns slope (points per week) and R-squared keyed by field.
         """
         if len(snapshots) < 2:
-            return {"slope": 0.0, "r_squared": 0.0, "intercept": 400.0}
-        
-        # Prepare data for linear regression
-        data_points = []
-        for snapshot in snapshots:
-            score = snapshot.get(score_field, 400) or 400
-            date = datetime.fromisoformat(snapshot["created_at"].replace('Z', '+00:00'))
-            # Convert to weeks since first snapshot
-            weeks = (date - datetime.fromisoformat(snapshots[0]["created_at"].replace('Z', '+00:00'))).days / 7.0
-            data_points.append((weeks, score))
-        
-        if len(data_points) < 2:
-            return {"slope": 0.0, "r_squared": 0.0, "intercept": 400.0}
-        
-        # Simple linear regression
-        n = len(data_points)
-        sum_x = sum(point[0] for point in data_points)
-        sum_y = sum(point[1] for point in data_points)
-        sum_xy = sum(point[0] * point[1] for point in data_points)
-        sum_x2 = sum(point[0] ** 2 for point in data_points)
-        sum_y2 = sum(point[1] ** 2 for point in data_points)
-        
-        # Calculate slope and intercept
-        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_x2 - sum_x ** 2)
-        intercept = (sum_y - slope * sum_x) / n
+            return {
+                field: {"slope": 0.0, "r_squared": 0.0, "intercept": 400.0}
+                for field in score_fields
+            }
         
-        # Calculate R-squared
-        y_mean = sum_y / n
-        ss_tot = sum((point[1] - y_mean) ** 2 for point in data_points)
-        ss_res = sum((point[1] - (slope * point[0] + intercept)) ** 2 for point in data_points)
-        r_squared = 1 - (ss_res / ss_tot) if ss_tot > 0 else 0.0
+        # Weeks since first snapshot (parse the baseline once, not per row)
+        start = _parse_timestamp(snapshots[0]["created_at"])
+        xs = [
+            (_parse_timestamp(snapshot["created_at"]) - start).days / 7.0
+            for snapshot in snapshots
+        ]
+        n = len(xs)
+        x_mean = sum(xs) / n
+        dxs = [x - x_mean for x in xs]
+        sxx = sum(dx * dx for dx in dxs)
+        
+        trends = {}
+        for field in score_fields:
+            ys = [snapshot.get(field, 400) or 400 for snapshot in snapshots]
+            y_mean = sum(ys) / n
+            
+            if sxx == 0:
+                # All snapshots on the same day: no trend to fit
+                trends[field] = {"slope": 0.0, "r_squared": 0.0, "intercept": round(y_mean, 1)}
+                continue
+            
+            # Closed-form least squares on centered data
+            sxy = syy = 0.0
+            for dx, y in zip(dxs, ys):
+                dy = y - y_mean
+                sxy += dx * dy
+                syy += dy * dy
+            
+            slope = sxy / sxx
+            intercept = y_mean - slope * x_mean
+            
+            # For a least-squares line, 1 - ss_res/ss_tot == sxy^2 / (sxx * syy)
+            r_squared = (sxy * sxy) / (sxx * syy) if syy > 0 else 0.0
+            
+            trends[field] = {
+                "slope": round(slope, 2),
+                "r_squared": round(r_squared, 3),
+                "intercept": round(intercept, 1)
+            }
         
-        return {
-            "slope": round(slope, 2),
-            "r_squared": round(r_squared, 3),
-            "intercept": round(intercept, 1)
-        }
+        return trends
     
     def _calculate_predictions(
         self, 
@@ -179,47 +236,43 @@ class PredictionService:
         rw_30_days = current_scores["rw"] + (rw_trend["slope"] * 4.3)
         total_30_days = math_30_days + rw_30_days
         
-        # Confidence intervals (based on R-squared and historical variance)
-        math_confidence = self._calculate_confidence_interval(
-            current_scores["math"], math_trend, 4.3
-        )
-        rw_confidence = self._calculate_confidence_interval(
-            current_scores["rw"], rw_trend, 4.3
-        )
-        
         return {
             "math_30_days": round(math_30_days),
             "rw_30_days": round(rw_30_days),
             "total_30_days": round(total_30_days),
-            "confidence_intervals": {
-                "math": math_confidence,
-                "rw": rw_confidence,
-                "total": {
-                    "optimistic": math_confidence["optimistic"] + rw_confidence["optimistic"],
-                    "realistic": math_confidence["realistic"] + rw_confidence["realistic"],
-                    "pessimistic": math_confidence["pessimistic"] + rw_confidence["pessimistic"]
-                }
-            }
+            # Confidence intervals (based on R-squared and historical variance)
+            "confidence_intervals": self._calculate_confidence_intervals(
+                current_scores, {"math": math_trend, "rw": rw_trend}, 4.3
+            )
         }
     
-    def _calculate_confidence_interval(
+    def _calculate_confidence_intervals(
         self, 
-        current_score: int, 
-        trend: Dict[str, float], 
+        current_scores: Dict[str, int], 
+        trends: Dict[str, Dict[str, float]], 
         weeks: float
-    ) -> Dict[str, int]:
-        """Calculate confidence intervals for predictions"""
-        predicted = current_score + (trend["slope"] * weeks)
+    ) -> Dict[str, Dict[str, int]]:
+        """Calculate confidence intervals per subject, plus their total"""
+        intervals = {}
+        total = {"optimistic": 0, "realistic": 0, "pessimistic": 0}
         
-        # Uncertainty based on R-squared and trend consistency
-        uncertainty_factor = max(0.1, 1 - trend["r_squared"])
-        uncertainty = 50 * uncertainty_factor  # Base uncertainty of 50 points
+        for subject, trend in trends.items():
+            predicted = current_scores[subject] + (trend["slope"] * weeks)
+            
+            # Uncertainty based on R-squared and trend consistency
+            uncertainty = 50 * max(0.1, 1 - trend["r_squared"])  # Base uncertainty of 50 points
+            
+            interval = {
+                "optimistic": round(predicted + uncertainty),
+                "realistic": round(predicted),
+                "pessimistic": round(predicted - uncertainty)
+            }
+            intervals[subject] = interval
+            for bound, value in interval.items():
+                total[bound] += value
         
-        return {
-            "optimistic": round(predicted + uncertainty),
-            "realistic": round(predicted),
-            "pessimistic": round(predicted - uncertainty)
-        }
+        intervals["total"] = total
+        return intervals
     
     def _calculate_goal_analysis(
         self,
@@ -273,12 +326,14 @@ class PredictionService:
         
         # Determine goal status
         goal_status = self._determine_goal_status(
-            current_scores, predictions, study_plan
+            predictions["total_30_days"], target_total
         )
         
         # Generate recommendations
         recommendations = self._generate_recommendations(
-            current_scores, predictions, study_plan, goal_status
+            goal_status,
+            math_gap=target_math - current_scores["math"],
+            rw_gap=target_rw - current_scores["rw"]
         )
         
         return {
@@ -306,14 +361,10 @@ class PredictionService:
     
     def _determine_goal_status(
         self,
-        current_scores: Dict[str, int],
-        predictions: Dict[str, Any],
-        study_plan: Dict
+        predicted_total: int,
+        target_total: int
     ) -> str:
         """Determine if user is on track to meet goals"""
-        target_total = study_plan.get("target_math_score", 0) + study_plan.get("target_rw_score", 0)
-        predicted_total = predictions["total_30_days"]
-        
         if predicted_total >= target_total:
             return "Ahead of Schedule"
         elif predicted_total >= target_total * 0.95:
@@ -325,10 +376,9 @@ class PredictionService:
     
     def _generate_recommendations(
         self,
-        current_scores: Dict[str, int],
-        predictions: Dict[str, Any],
-        study_plan: Dict,
-        goal_status: str
+        goal_status: str,
+        math_gap: int,
+        rw_gap: int
     ) -> List[str]:
         """Generate personalized recommendations"""
         recommendations = []
@@ -347,9 +397,6 @@ class PredictionService:
             recommendations.append("Consider intensive practice sessions or tutoring.")
         
         # Subject-specific recommendations
-        math_gap = study_plan.get("target_math_score", 0) - current_scores["math"]
-        rw_gap = study_plan.get("target_rw_score", 0) - current_scores["rw"]
-        
         if math_gap > rw_gap:
             recommendations.append("📊 Focus more on Math practice - it's your bigger opportunity.")
         elif rw_gap > math_gap:
@@ -365,19 +412,22 @@ class PredictionService:
         weeks: int
     ) -> List[Dict[str, Any]]:
         """Generate prediction timeline for the next N weeks"""
+        # Anchor every point to the same "now" so dates can't drift mid-loop
+        today = datetime.now()
+        math_current, math_slope = current_scores["math"], math_trend["slope"]
+        rw_current, rw_slope = current_scores["rw"], rw_trend["slope"]
         timeline = []
         
         for week in range(1, weeks + 1):
-            math_score = current_scores["math"] + (math_trend["slope"] * week)
-            rw_score = current_scores["rw"] + (rw_trend["slope"] * week)
-            total_score = math_score + rw_score
+            math_score = math_current + math_slope * week
+            rw_score = rw_current + rw_slope * week
             
             timeline.append({
                 "week": week,
                 "math_score": round(math_score),
                 "rw_score": round(rw_score),
-                "total_score": round(total_score),
-                "date": (datetime.now() + timedelta(weeks=week)).strftime("%Y-%m-%d")
+                "total_score": round(math_score + rw_score),
+                "date": (today + timedelta(weeks=week)).strftime("%Y-%m-%d")
             })
         
         return timeline
@@ -1,9 +1,13 @@
 from typing import Optional, Dict, Any
+import asyncio
 from datetime import date, datetime, timedelta
 from uuid import UUID
-import json
 import logging
+import os
 
+from postgrest.types import CountMethod, ReturnMethod
+
+from ..core.cache import TTLCache
 from ..models.profile import (
     UserProfile,
     UserProfileUpdate,
@@ -15,26 +19,58 @@ from ..models.profile import (
 logger = logging.getLogger(__name__)
 
 class ProfileService:
+    ALLOWED_PHOTO_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}
+    MAX_PHOTO_SIZE = 5 * 1024 * 1024  # 5MB
+
+    # Profiles and preferences are read on every page but rarely written; this
+    # service drops a user's entries after each of its writes
+    _profile_cache = TTLCache(ttl_seconds=300)
+    _preferences_cache = TTLCache(ttl_seconds=1800)
+
     def __init__(self, db):
         self.db = db
 
+    @classmethod
+    def invalidate_profile(cls, user_id: str) -> None:
+        """Drop the cached profile for a user"""
+        cls._profile_cache.invalidate(user_id)
+
+    @classmethod
+    def invalidate_preferences(cls, user_id: str) -> None:
+        """Drop the cached preferences for a user"""
+        cls._preferences_cache.invalidate(user_id)
+
+    def _update_without_row(self, table: str, column: str, value: str, update_data: Dict[str, Any]) -> bool:
+        """Apply an update without reading the row back; True if a row matched"""
+        response = self.db.table(table).update(
+            update_data, count=CountMethod.exact, returning=ReturnMethod.minimal
+        ).eq(column, value).execute()
+
+        return bool(response.count)
+
     async def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
         """Get complete user profile"""
+        cached = self._profile_cache.get(user_id)
+        if cached is not None:
+            return cached
+
         response = self.db.table("users").select("*").eq("id", user_id).execute()
 
         if not response.data:
             logger.info(f"No user profile found for user {user_id}")
             return None
 
-        user_data = response.data[0]
-        return UserProfile(**user_data)
+        # Validate once when filling the cache; hits reuse the parsed model
+        profile = UserProfile.model_validate(response.data[0])
+        self._profile_cache.set(user_id, profile)
+        return profile
 
     async def update_user_profile(
         self, user_id: str, profile_update: UserProfileUpdate
     ) -> Optional[UserProfile]:
         """Update user profile fields"""
-        # Convert to dict and include None values to allow clearing fields
-        update_data = profile_update.dict()
+        # Only fields the client sent; an explicit None still clears the field
+        update_data = profile_update.model_dump(exclude_unset=True)
 
         if not update_data:
             logger.info(f"No updates provided for user {user_id}")
@@ -42,11 +78,14 @@ class ProfileService:
 
         try:
             response = self.db.table("users").update(update_data).eq("id", user_id).execute()
+            self.invalidate_profile(user_id)
             if not response.data:
                 logger.warning(f"No data returned when updating profile for user {user_id}")
                 return None
             logger.info(f"Successfully updated profile for user {user_id}")
-            return UserProfile(**response.data[0])
+            profile = UserProfile.model_validate(response.data[0])
+            self._profile_cache.set(user_id, profile)
+            return profile
         except Exception as e:
             logger.error(f"Error updating profile for user {user_id}: {str(e)}", exc_info=True)
             raise
@@ -55,8 +94,21 @@ class ProfileService:
         try:
             logger.info(f"Starting upload for user {user_id}, file: {file.filename}, content type: {file.content_type}")
 
-            # Read file content
-            content = await file.read()
+            # Validate extension; it becomes part of the storage path
+            _, file_ext = os.path.splitext(file.filename or "")
+            file_ext = file_ext.lstrip(".").lower()
+            if file_ext not in self.ALLOWED_PHOTO_EXTENSIONS:
+                logger.error(f"Error: Unsupported file extension '{file_ext}'")
+                return None
+
+            # Validate file size before buffering the upload
+            MAX_SIZE = self.MAX_PHOTO_SIZE
+            if file.size is not None and file.size > MAX_SIZE:
+                logger.error(f"Error: File size {file.size} exceeds maximum allowed size {MAX_SIZE}")
+                return None
+
+            # Read at most one byte past the limit; storage upload needs bytes, not a file object
+            content = await file.read(MAX_SIZE + 1)
             if not content:
                 logger.error("Error: File content is empty")
                 return None
@@ -64,14 +116,11 @@ class ProfileService:
             file_size = len(content)
             logger.info(f"File size: {file_size} bytes")
 
-            # Validate file size (5MB max)
-            MAX_SIZE = 5 * 1024 * 1024  # 5MB
             if file_size > MAX_SIZE:
-                logger.error(f"Error: File size {file_size} exceeds maximum allowed size {MAX_SIZE}")
+                logger.error(f"Error: File size exceeds maximum allowed size {MAX_SIZE}")
                 return None
 
             # Generate unique filename
-            file_ext = file.filename.split('.')[-1].lower()
             file_name = f"{user_id}/profile.{file_ext}"
 
             logger.info(f"Attempting to upload to bucket 'profile-photos' with filename: {file_name}")
@@ -103,6 +152,7 @@ class ProfileService:
                 update_response = self.db.table("users").update(
                     {"profile_photo_url": photo_url}
                 ).eq("id", user_id).execute()
+                self.invalidate_profile(user_id)
 
                 if not update_response.data:
                     logger.error("Error: Failed to update user profile with photo URL")
@@ -112,13 +162,13 @@ class ProfileService:
                 return photo_url
 
             except Exception as upload_error:
-                logger.error(f"Error during upload: {str(upload_error)}")
+                logger.exception("Error during upload")
                 if hasattr(upload_error, 'response') and hasattr(upload_error.response, 'content'):
-                    logger.error(f"Error details: {upload_error.response.content}")
+                    logger.error("Error details: %s", upload_error.response.content)
                 return None
 
-        except Exception as e:
-            logger.error(f"Unexpected error in upload_profile_photo: {str(e)}")
+        except Exception:
+            logger.exception("Unexpected error in upload_profile_photo")
             raise
 
     async def delete_profile_photo(self, user_id: str) -> bool:
@@ -129,35 +179,52 @@ class ProfileService:
                 "id", user_id
             ).execute()
 
-            if user_response.data and user_response.data[0].get("profile_photo_url"):
-                # Extract file path from URL
-                photo_url = user_response.data[0]["profile_photo_url"]
-                # Parse file path from URL (implementation depends on URL structure)
-
-                # Delete old photo if exists
-                if user_response.data[0].get("profile_photo_url"):
-                    try:
-                        old_photo_path = user_response.data[0]["profile_photo_url"].split('/profile-photos/')[-1]
-                        self.db.storage.from_("profile-photos").remove([old_photo_path])
-                        logger.info(f"Deleted old profile photo for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Error deleting old profile photo for user {user_id}: {str(e)}", exc_info=True)
-                        # Continue with update even if deletion fails
-
-            # Update user profile to remove photo URL
-            self.db.table("users").update(
-                {"profile_photo_url": None}
-            ).eq("id", user_id).execute()
+            photo_url = user_response.data[0].get("profile_photo_url") if user_response.data else None
+
+            # Removing the stored file and clearing the URL are independent, so run them together
+            clear_url = asyncio.to_thread(
+                self.db.table("users").update({"profile_photo_url": None}).eq("id", user_id).execute
+            )
+
+            if photo_url:
+                old_photo_path = photo_url.split('/profile-photos/')[-1]
+                remove_photo = asyncio.to_thread(
+                    self.db.storage.from_("profile-photos").remove, [old_photo_path]
+                )
+                remove_result, update_result = await asyncio.gather(
+                    remove_photo, clear_url, return_exceptions=True
+                )
+
+                if isinstance(remove_result, Exception):
+                    # Continue with update even if deletion fails
+                    logger.error(
+                        "Error deleting old profile photo for user %s",
+                        user_id,
+                        exc_info=remove_result
+                    )
+                else:
+                    logger.info(f"Deleted old profile photo for user {user_id}")
+
+                if isinstance(update_result, Exception):
+                    raise update_result
+            else:
+                await clear_url
+
+            self.invalidate_profile(user_id)
 
             logger.info(f"Successfully deleted profile photo for user {user_id}")
             return True
 
-        except Exception as e:
-            logger.error(f"Error deleting profile photo: {str(e)}")
+        except Exception:
+            logger.exception("Error deleting profile photo for user %s", user_id)
             raise
 
     async def get_user_preferences(self, user_id: str) -> Optional[UserPreferences]:
         """Get user preferences"""
+        cached = self._preferences_cache.get(user_id)
+        if cached is not None:
+            return cached
+
         response = self.db.table("user_preferences").select("*").eq(
             "user_id", user_id
         ).execute()
@@ -165,7 +232,9 @@ class ProfileService:
         if not response.data:
             return None
 
-        return UserPreferences(**response.data[0])
+        preferences = UserPreferences.model_validate(response.data[0])
+        self._preferences_cache.set(user_id, preferences)
+        return preferences
 
     async def create_default_preferences(self, user_id: str) -> UserPreferences:
         """Create default preferences for a user"""
@@ -195,9 +264,12 @@ class ProfileService:
         }
 
         response = self.db.table("user_preferences").insert(default_prefs).execute()
+        self.invalidate_preferences(user_id)
 
         if response.data:
-            return UserPreferences(**response.data[0])
+            preferences = UserPreferences.model_validate(response.data[0])
+            self._preferences_cache.set(user_id, preferences)
+            return preferences
 
         return None
 
@@ -206,101 +278,62 @@ class ProfileService:
     ) -> Optional[UserPreferences]:
         """Update user preferences"""
         # Filter out None values
-        update_data = {k: v for k, v in preferences_update.dict().items() if v is not None}
+        update_data = preferences_update.model_dump(exclude_none=True)
 
         if not update_data:
             return await self.get_user_preferences(user_id)
 
-        # Handle JSONB fields
-        if "email_notifications" in update_data:
-            update_data["email_notifications"] = json.dumps(update_data["email_notifications"])
-        if "push_notifications" in update_data:
-            update_data["push_notifications"] = json.dumps(update_data["push_notifications"])
-
         response = self.db.table("user_preferences").update(update_data).eq(
             "user_id", user_id
         ).execute()
+        self.invalidate_preferences(user_id)
 
         if not response.data:
             # Preferences might not exist, create them
             return await self.create_default_preferences(user_id)
 
-        return UserPreferences(**response.data[0])
+        preferences = UserPreferences.model_validate(response.data[0])
+        self._preferences_cache.set(user_id, preferences)
+        return preferences
 
     async def get_user_stats(self, user_id: str) -> Optional[UserProfileStats]:
         """Get aggregated user statistics"""
-        stats = UserProfileStats()
+        # Active plan, session totals, answered questions and latest snapshot in one call
+        response = self.db.rpc("get_user_profile_stats", {"p_user_id": user_id}).execute()
+        return self._build_user_stats(response.data or {})
 
-        # First get the active study plan ID
-        study_plan_response = self.db.table("study_plans").select("id").eq(
-            "user_id", user_id
-        ).eq("is_active", True).execute()
+    def _build_user_stats(self, data: Dict[str, Any]) -> UserProfileStats:
+        """Convert a get_user_profile_stats payload into UserProfileStats"""
+        stats = UserProfileStats()
 
-        if not study_plan_response.data:
+        plan = data.get("study_plan")
+        if not plan:
             # No active study plan, return empty stats
             return stats
 
-        study_plan_id = study_plan_response.data[0]["id"]
-
-        # Get practice session stats
-        sessions_response = self.db.table("practice_sessions").select(
-            "id, status, completed_at, started_at"
-        ).eq("study_plan_id", study_plan_id).execute()
-
-        if sessions_response.data:
-            completed_sessions = [s for s in sessions_response.data if s.get("status") == "completed"]
-            stats.total_practice_sessions = len(completed_sessions)
-
-            # Calculate total study time
-            for session in completed_sessions:
-                if session.get("started_at") and session.get("completed_at"):
-                    start = datetime.fromisoformat(session["started_at"])
-                    end = datetime.fromisoformat(session["completed_at"])
-                    duration = (end - start).total_seconds() / 3600  # Convert to hours
-                    stats.total_study_hours += duration
-
-            if stats.total_practice_sessions > 0:
-                stats.average_session_duration = stats.total_study_hours / stats.total_practice_sessions * 60  # In minutes
-
-        # Get question stats
-        # Note: session_questions doesn't have is_correct, we need to check user_answer vs correct answer
-        questions_response = self.db.table("session_questions").select(
-            "status, user_answer, question_id"
-        ).in_("session_id", [s["id"] for s in sessions_response.data] if sessions_response.data else []).execute()
-
-        if questions_response.data:
-            answered_questions = [q for q in questions_response.data if q.get("status") == "answered"]
-            stats.total_questions_answered = len(answered_questions)
-
-            # For now, we'll skip calculating correct answers since it requires joining with questions table
-            # This would need a more complex query to compare user_answer with question's correct_answer
-            stats.total_correct_answers = 0
-            stats.accuracy_percentage = 0.0
-
-        # Get full study plan details for scores and test date
-        # (we already have the ID from earlier)
-        full_plan_response = self.db.table("study_plans").select("*").eq(
-            "id", study_plan_id
-        ).execute()
-
-        if full_plan_response.data:
-            plan = full_plan_response.data[0]
-            stats.current_math_score = plan.get("current_math_score")
-            stats.target_math_score = plan.get("target_math_score")
-            stats.current_rw_score = plan.get("current_rw_score")
-            stats.target_rw_score = plan.get("target_rw_score")
-
-            if plan.get("test_date"):
-                test_date = datetime.fromisoformat(plan["test_date"]).date()
-                stats.days_until_test = (test_date - date.today()).days
-
-        # Get latest performance snapshot for improvement tracking
-        snapshot_response = self.db.table("user_performance_snapshots").select(
-            "predicted_sat_math, predicted_sat_rw"
-        ).eq("user_id", user_id).order("created_at", desc=True).limit(1).execute()
-
-        if snapshot_response.data and stats.current_math_score and stats.current_rw_score:
-            latest = snapshot_response.data[0]
+        stats.total_practice_sessions = data["completed_sessions"]
+        stats.total_study_hours = data["study_seconds"] / 3600  # Convert to hours
+        if stats.total_practice_sessions > 0:
+            stats.average_session_duration = stats.total_study_hours / stats.total_practice_sessions * 60  # In minutes
+
+        # Correct answers come from session_questions.is_correct, set when the answer was graded
+        stats.total_questions_answered = data["answered_questions"]
+        stats.total_correct_answers = data["correct_answers"]
+        if stats.total_questions_answered > 0:
+            stats.accuracy_percentage = 100.0 * stats.total_correct_answers / stats.total_questions_answered
+
+        stats.current_math_score = plan.get("current_math_score")
+        stats.target_math_score = plan.get("target_math_score")
+        stats.current_rw_score = plan.get("current_rw_score")
+        stats.target_rw_score = plan.get("target_rw_score")
+
+        if plan.get("test_date"):
+            test_date = datetime.fromisoformat(plan["test_date"]).date()
+            stats.days_until_test = (test_date - date.today()).days
+
+        # Latest performance snapshot for improvement tracking
+        latest = data.get("latest_snapshot")
+        if latest and stats.current_math_score and stats.current_rw_score:
             if latest.get("predicted_sat_math"):
                 stats.improvement_math = latest["predicted_sat_math"] - stats.current_math_score
             if latest.get("predicted_sat_rw"):
@@ -308,10 +341,50 @@ class ProfileService:
 
         return stats
 
+    async def get_profile_bundle(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get profile, preferences and stats with a single database call.
+
+        Stats are never cached: practice and mock exam answers change them
+        outside this service. When profile and preferences are both cached,
+        only the stats function is called.
+
+        Returns a dict with "profile", "preferences" and "stats" keys, or None
+        if the user has no profile.
+        """
+        profile = self._profile_cache.get(user_id)
+        preferences = self._preferences_cache.get(user_id)
+        if profile is not None and preferences is not None:
+            return {
+                "profile": profile,
+                "preferences": preferences,
+                "stats": await self.get_user_stats(user_id),
+            }
+
+        response = self.db.rpc("load_profile_bundle", {"p_user_id": user_id}).execute()
+        data = response.data or {}
+
+        if not data.get("profile"):
+            logger.info(f"No user profile found for user {user_id}")
+            return None
+
+        profile = UserProfile.model_validate(data["profile"])
+        preferences = None
+        if data.get("preferences"):
+            preferences = UserPreferences.model_validate(data["preferences"])
+
+        bundle = {
+            "profile": profile,
+            "preferences": preferences,
+            "stats": self._build_user_stats(data.get("stats") or {}),
+        }
+        self._profile_cache.set(user_id, profile)
+        if preferences is not None:
+            self._preferences_cache.set(user_id, preferences)
+        return bundle
+
     async def mark_onboarding_complete(self, user_id: str) -> bool:
         """Mark user onboarding as complete"""
-        response = self.db.table("users").update(
-            {"onboarding_completed": True}
-        ).eq("id", user_id).execute()
-
-        return bool(response.data)
\ No newline at end of file
+        updated = self._update_without_row("users", "id", user_id, {"onboarding_completed": True})
+        self.invalidate_profile(user_id)
+        return updated
\ No newline at end of file
@@ -0,0 +1,45 @@
+import random
+from typing import Dict, List
+
+
+def sample_by_distribution(
+    questions_by_difficulty: Dict[str, List[Dict]],
+    distribution: Dict[str, float],
+    count: int,
+    rng: random.Random = random,
+) -> List[Dict]:
+    """
+    Sample up to `count` questions across difficulties in a single pass.
+
+    Targets are allocated proportionally (largest remainder) so they sum to
+    `count`. Difficulties are visited from least to most spare capacity so any
+    shortfall carries forward onto difficulties that can absorb it.
+
+    Args:
+        questions_by_difficulty: {difficulty: [questions]}
+        distribution: Target ratio per difficulty
+        count: Number of questions wanted
+        rng: Random generator used for sampling (defaults to the random module)
+
+    Returns:
+        List of sampled questions (shorter than `count` only if the pool is)
+    """
+    raw_targets = {difficulty: count * ratio for difficulty, ratio in distribution.items()}
+    targets = {difficulty: int(t) for difficulty, t in raw_targets.items()}
+    leftover = count - sum(targets.values())
+    by_remainder = sorted(raw_targets, key=lambda d: raw_targets[d] - targets[d], reverse=True)
+    for difficulty in by_remainder[:leftover]:
+        targets[difficulty] += 1
+
+    selected = []
+    deficit = 0
+    for difficulty in sorted(
+        targets, key=lambda d: len(questions_by_difficulty.get(d, [])) - targets[d]
+    ):
+        available = questions_by_difficulty.get(difficulty, [])
+        wanted = targets[difficulty] + deficit
+        take = min(wanted, len(available))
+        deficit = wanted - take
+        selected.extend(rng.sample(available, take))
+
+    return selected
@@ -2,24 +2,65 @@ from datetime import date, timedelta
 from typing import List, Dict, Optional
 from uuid import UUID
 from supabase import Client
+import heapq
 import math
 import random
+from app.core.cache import TTLCache
 from app.services.bkt_service import BKTService
 
 
 class StudyPlanService:
+    # Curriculum tree shared by every plan; the API never edits it, so refresh hourly
+    _topics_cache = TTLCache(ttl_seconds=3600, max_entries=1)
+
     def __init__(self, db: Client):
         self.db = db
 
+    def _load_question_index(self, topic_ids: List[str]) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        Fetch active questions for all topics and index them, one page at a time.
+
+        Returns:
+            {topic_id: {difficulty: [questions]}} with only the columns selection needs
+        """
+        if not topic_ids:
+            return {}
+
+        question_index = {}
+
+        # Paginate so PostgREST's max-rows cap can't silently drop later topics
+        batch_size = 1000
+        offset = 0
+
+        while True:
+            batch = self.db.table("questions").select(
+                "id, topic_id, difficulty"
+            ).in_("topic_id", topic_ids).eq("is_active", True).order("id").range(
+                offset, offset + batch_size - 1
+            ).execute()
+
+            for q in batch.data:
+                # difficulty is NOT NULL and limited to E/M/H by the schema
+                by_difficulty = question_index.setdefault(q["topic_id"], {"E": [], "M": [], "H": []})
+                by_difficulty[q["difficulty"]].append(q)
+
+            if len(batch.data) < batch_size:
+                break
+
+            offset += batch_size
+
+        return question_index
+
     async def _assign_questions_to_session(
         self,
         session_id: str,
-        topics: List[Dict]
+        topics: List[Dict],
+        question_index: Dict[str, Dict[str, List[Dict]]]
     ):
         """
         Assign specific questions to a practice session.
 
-        For each topic, fetch available questions and assign them to session_questions.
+        For each topic, pick questions from the prebuilt index and assign them to session_questions.
         Questions are distributed across difficulty levels (Easy, Medium, Hard).
         """
         display_order = 1  # Track global display order across all topics
@@ -32,26 +73,14 @@ class StudyPlanService:
             if num_questions == 0:
                 continue
 
-            # Fetch available questions for this topic
-            # Get more questions than needed so we can distribute by difficulty
-            questions_response = self.db.table("questions").select("*").eq(
-                "topic_id", topic_id
-            ).eq("is_active", True).limit(num_questions * 3).execute()
+            # Questions for this topic, already grouped by difficulty
+            by_difficulty = question_index.get(topic_id)
 
-            available_questions = questions_response.data
-
-            if not available_questions:
+            if not by_difficulty:
                 # No questions available for this topic, skip
                 continue
 
             # Distribute questions by difficulty (33% E, 33% M, 33% H)
-            # Group by difficulty
-            by_difficulty = {"E": [], "M": [], "H": []}
-            for q in available_questions:
-                difficulty = q.get("difficulty")
-                if difficulty in by_difficulty:
-                    by_difficulty[difficulty].append(q)
-
             # Calculate how many questions per difficulty
             questions_per_difficulty = num_questions // 3
             remainder = num_questions % 3
@@ -76,7 +105,12 @@ class StudyPlanService:
             if len(selected_questions) < num_questions:
                 remaining_needed = num_questions - len(selected_questions)
                 selected_ids = {q["id"] for q in selected_questions}
-                remaining_pool = [q for q in available_questions if q["id"] not in selected_ids]
+                remaining_pool = [
+                    q
+                    for questions in by_difficulty.values()
+                    for q in questions
+                    if q["id"] not in selected_ids
+                ]
 
                 if remaining_pool:
                     additional = random.sample(
@@ -109,7 +143,12 @@ class StudyPlanService:
         """
         Fetch all categories and their topics from the database.
         Returns a dictionary grouped by section (math, reading_writing).
+        Results are cached with a TTL.
         """
+        cached = self._topics_cache.get("all")
+        if cached is not None:
+            return cached
+
         # Fetch all categories
         categories_response = self.db.table("categories").select("*").execute()
         categories = categories_response.data
@@ -139,6 +178,8 @@ class StudyPlanService:
             }
             result[category["section"]].append(category_with_topics)
 
+        if categories:
+            self._topics_cache.set("all", result)
         return result
 
     def group_topics_into_sessions(
@@ -408,6 +449,13 @@ class StudyPlanService:
 
         print(f"[BATCH] Scheduled {len(scheduled_sessions)} sessions from {start_date}")
 
+        # Index every topic's questions once for the whole batch
+        question_index = self._load_question_index(list({
+            topic["topic_id"]
+            for session in scheduled_sessions
+            for topic in session["topics"]
+        }))
+
         # Save sessions to database
         created_count = 0
 
@@ -422,7 +470,7 @@ class StudyPlanService:
             session_id = session_record.data[0]["id"]
 
             # Assign questions to session
-            await self._assign_questions_to_session(session_id, session["topics"])
+            await self._assign_questions_to_session(session_id, session["topics"], question_index)
 
             created_count += 1
 
@@ -713,32 +761,27 @@ class StudyPlanService:
         # Get all topics with weights
         all_topics = await self._get_all_topics_with_weights()
 
-        # Calculate priorities for ALL topics
-        priorities = []
-        for topic in all_topics:
-            category_weight = topic["category_weight"] / 100.0
-            mastery = mastery_lookup.get(topic["id"], 0.25)  # Default 25%
-            weakness = 1.0 - mastery
+        def priority_of(topic: Dict) -> float:
+            # Priority = weight × weakness (default mastery 25%)
+            return topic["category_weight"] / 100.0 * (1.0 - mastery_lookup.get(topic["id"], 0.25))
 
-            # Priority = weight × weakness
-            priority_score = category_weight * weakness
+        # Take top N by priority, highest first (no section balancing!).
+        # nlargest avoids sorting every topic; ties keep topic order like a stable sort.
+        focus_topics = []
+        for topic in heapq.nlargest(num_topics, all_topics, key=priority_of):
+            category_weight = topic["category_weight"] / 100.0
+            mastery = mastery_lookup.get(topic["id"], 0.25)
 
-            priorities.append({
+            focus_topics.append({
                 "topic_id": topic["id"],
                 "topic_name": topic["name"],
                 "category_name": topic["category_name"],
                 "section": topic["section"],
-                "priority": priority_score,
+                "priority": category_weight * (1.0 - mastery),
                 "mastery": mastery,
                 "weight": category_weight
             })
 
-        # Sort by priority (highest first)
-        priorities.sort(key=lambda x: x["priority"], reverse=True)
-
-        # Take top N (no section balancing!)
-        focus_topics = priorities[:num_topics]
-
         # Log what we picked
         math_count = sum(1 for t in focus_topics if t["section"] == "math")
         rw_count = len(focus_topics) - math_count
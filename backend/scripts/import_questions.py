@@ -13,11 +13,12 @@ Usage:
     python scripts/import_questions.py --limit 100
 """
 
-import json
+import mmap
 import sys
 import os
 import uuid
 from pathlib import Path
+import orjson
 from supabase import create_client
 from dotenv import load_dotenv
 import argparse
@@ -160,8 +161,10 @@ def import_questions(limit=None, dry_run=False):
     json_path = Path(__file__).parent.parent / 'question_bank.json'
 
     print(f"📂 Loading questions from: {json_path}")
-    with open(json_path) as f:
-        data = json.load(f)
+    # Parse straight from the mapped bytes: no text decode or str copy of the file
+    with open(json_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            data = orjson.loads(view)
 
     total_questions = len(data)
     print(f"📊 Total questions in file: {total_questions}")
@@ -0,0 +1,40 @@
+-- Migration: Add normalized answer columns to questions table
+-- Purpose: Normalize correct/acceptable answers once at write time instead of on every submission
+-- Date: 2026-10-16
+
+ALTER TABLE questions
+ADD COLUMN normalized_correct_answer TEXT[],
+ADD COLUMN normalized_acceptable_answers TEXT[];
+
+-- Mirrors AnswerValidationService.normalize_answer: trim whitespace and lowercase each element
+CREATE OR REPLACE FUNCTION normalize_answer_array(answers JSONB)
+RETURNS TEXT[] AS $$
+    SELECT CASE
+        WHEN answers IS NULL OR jsonb_typeof(answers) <> 'array' THEN ARRAY[]::TEXT[]
+        ELSE ARRAY(
+            SELECT lower(btrim(elem, E' \t\n\r'))
+            FROM jsonb_array_elements_text(answers) AS elem
+        )
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION set_normalized_answers()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.normalized_correct_answer = normalize_answer_array(NEW.correct_answer);
+    NEW.normalized_acceptable_answers = normalize_answer_array(NEW.acceptable_answers);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER set_questions_normalized_answers
+    BEFORE INSERT OR UPDATE OF correct_answer, acceptable_answers ON questions
+    FOR EACH ROW EXECUTE FUNCTION set_normalized_answers();
+
+-- Backfill existing questions
+UPDATE questions
+SET normalized_correct_answer = normalize_answer_array(correct_answer),
+    normalized_acceptable_answers = normalize_answer_array(acceptable_answers);
+
+COMMENT ON COLUMN questions.normalized_correct_answer IS 'Trimmed, lowercased correct_answer (maintained by trigger)';
+COMMENT ON COLUMN questions.normalized_acceptable_answers IS 'Trimmed, lowercased acceptable_answers (maintained by trigger)';
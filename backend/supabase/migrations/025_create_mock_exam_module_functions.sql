@@ -0,0 +1,89 @@
+-- Migration: Mock exam module lifecycle functions
+-- Purpose: Do the ownership check, module update and exam bookkeeping for
+--          starting/completing a module in one round trip
+-- Date: 2026-10-16
+
+-- Errors use P0002 (not found) and 42501 (not owner) so the API can map them to 404/403
+
+CREATE OR REPLACE FUNCTION start_mock_exam_module(p_module_id UUID, p_user_id UUID)
+RETURNS JSONB AS $$
+DECLARE
+    v_owner UUID;
+    v_module mock_exam_modules;
+BEGIN
+    SELECT e.user_id INTO v_owner
+    FROM mock_exam_modules m
+    JOIN mock_exams e ON e.id = m.exam_id
+    WHERE m.id = p_module_id
+    FOR UPDATE OF m;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Module not found' USING ERRCODE = 'P0002';
+    END IF;
+
+    IF v_owner <> p_user_id THEN
+        RAISE EXCEPTION 'Module does not belong to user' USING ERRCODE = '42501';
+    END IF;
+
+    UPDATE mock_exam_modules
+    SET status = 'in_progress', started_at = NOW()
+    WHERE id = p_module_id
+    RETURNING * INTO v_module;
+
+    -- First module started moves the exam into progress
+    UPDATE mock_exams
+    SET status = 'in_progress', started_at = NOW()
+    WHERE id = v_module.exam_id AND status = 'not_started';
+
+    RETURN to_jsonb(v_module);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION complete_mock_exam_module(
+    p_module_id UUID,
+    p_user_id UUID,
+    p_time_remaining_seconds INTEGER DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_owner UUID;
+    v_raw_score INTEGER;
+    v_module mock_exam_modules;
+    v_all_completed BOOLEAN;
+BEGIN
+    SELECT e.user_id INTO v_owner
+    FROM mock_exam_modules m
+    JOIN mock_exams e ON e.id = m.exam_id
+    WHERE m.id = p_module_id
+    FOR UPDATE OF m;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Module not found' USING ERRCODE = 'P0002';
+    END IF;
+
+    IF v_owner <> p_user_id THEN
+        RAISE EXCEPTION 'Module does not belong to user' USING ERRCODE = '42501';
+    END IF;
+
+    SELECT COUNT(*) INTO v_raw_score
+    FROM mock_exam_questions
+    WHERE module_id = p_module_id AND is_correct IS TRUE;
+
+    UPDATE mock_exam_modules
+    SET status = 'completed',
+        completed_at = NOW(),
+        raw_score = v_raw_score,
+        time_remaining_seconds = p_time_remaining_seconds
+    WHERE id = p_module_id
+    RETURNING * INTO v_module;
+
+    SELECT bool_and(status = 'completed') INTO v_all_completed
+    FROM mock_exam_modules
+    WHERE exam_id = v_module.exam_id;
+
+    RETURN jsonb_build_object(
+        'module', to_jsonb(v_module),
+        'all_completed', COALESCE(v_all_completed, FALSE)
+    );
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,17 @@
+-- Migration: Mock exam section raw score aggregate
+-- Purpose: Sum module raw scores per section in the database when finalizing an exam
+-- Date: 2026-10-16
+
+CREATE OR REPLACE FUNCTION get_mock_exam_raw_scores(p_exam_id UUID)
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'math_raw', COALESCE(SUM(raw_score) FILTER (
+            WHERE module_type IN ('math_module_1', 'math_module_2')
+        ), 0),
+        'rw_raw', COALESCE(SUM(raw_score) FILTER (
+            WHERE module_type IN ('rw_module_1', 'rw_module_2')
+        ), 0)
+    )
+    FROM mock_exam_modules
+    WHERE exam_id = p_exam_id;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,20 @@
+-- Migration: Topic performance aggregate
+-- Purpose: Count a user's answered/correct practice questions for a topic in the
+--          database instead of shipping every row to the API
+-- Date: 2026-10-16
+
+CREATE OR REPLACE FUNCTION get_topic_performance(p_topic_id UUID, p_user_id UUID)
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        -- is_correct is set on submit by AnswerValidationService (normalization,
+        -- ordering and acceptable answers), so reuse it rather than re-grading here
+        'topic_correct', COUNT(*) FILTER (WHERE sq.is_correct),
+        'topic_total', COUNT(*)
+    )
+    FROM session_questions sq
+    JOIN practice_sessions ps ON ps.id = sq.session_id
+    JOIN study_plans sp ON sp.id = ps.study_plan_id
+    WHERE sq.topic_id = p_topic_id
+      AND sq.status = 'answered'
+      AND sp.user_id = p_user_id;
+$$ LANGUAGE sql STABLE;
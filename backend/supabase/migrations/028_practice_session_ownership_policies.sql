@@ -0,0 +1,27 @@
+-- Migration: Enforce practice session ownership with RLS
+-- Purpose: Replace the permissive MVP policy on practice_sessions so the database
+--          hides other users' sessions and the API no longer compares owners in Python
+-- Date: 2026-10-16
+
+DROP POLICY IF EXISTS "Allow all practice session operations for MVP" ON practice_sessions;
+DROP POLICY IF EXISTS "Users can view own practice sessions" ON practice_sessions;
+DROP POLICY IF EXISTS "Users can update own practice sessions" ON practice_sessions;
+
+-- Users can only access sessions from their own study plans
+CREATE POLICY "Users can manage own practice sessions" ON practice_sessions
+    FOR ALL
+    TO authenticated
+    USING (
+        EXISTS (
+            SELECT 1 FROM study_plans
+            WHERE study_plans.id = practice_sessions.study_plan_id
+            AND study_plans.user_id = auth.uid()
+        )
+    )
+    WITH CHECK (
+        EXISTS (
+            SELECT 1 FROM study_plans
+            WHERE study_plans.id = practice_sessions.study_plan_id
+            AND study_plans.user_id = auth.uid()
+        )
+    );
@@ -0,0 +1,50 @@
+-- Migration: User profile stats aggregate
+-- Purpose: Gather the profile stats inputs (active plan, session totals, answered
+--          and correct questions, latest snapshot) in one call instead of five round trips
+-- Date: 2026-10-16
+
+CREATE OR REPLACE FUNCTION get_user_profile_stats(p_user_id UUID)
+RETURNS JSONB AS $$
+    WITH plan AS (
+        SELECT *
+        FROM study_plans
+        WHERE user_id = p_user_id
+          AND is_active
+        LIMIT 1
+    ),
+    sessions AS (
+        SELECT
+            COUNT(*) FILTER (WHERE ps.status = 'completed') AS completed_sessions,
+            COALESCE(SUM(EXTRACT(EPOCH FROM ps.completed_at - ps.started_at))
+                FILTER (WHERE ps.status = 'completed'), 0) AS study_seconds
+        FROM practice_sessions ps
+        JOIN plan ON plan.id = ps.study_plan_id
+    ),
+    answered AS (
+        SELECT
+            COUNT(*) AS answered_questions,
+            COUNT(*) FILTER (WHERE sq.is_correct) AS correct_answers
+        FROM session_questions sq
+        JOIN practice_sessions ps ON ps.id = sq.session_id
+        JOIN plan ON plan.id = ps.study_plan_id
+        WHERE sq.status = 'answered'
+    )
+    SELECT jsonb_build_object(
+        'study_plan', (SELECT to_jsonb(plan) FROM plan),
+        'completed_sessions', sessions.completed_sessions,
+        'study_seconds', sessions.study_seconds,
+        'answered_questions', answered.answered_questions,
+        'correct_answers', answered.correct_answers,
+        'latest_snapshot', (
+            SELECT jsonb_build_object(
+                'predicted_sat_math', s.predicted_sat_math,
+                'predicted_sat_rw', s.predicted_sat_rw
+            )
+            FROM user_performance_snapshots s
+            WHERE s.user_id = p_user_id
+            ORDER BY s.created_at DESC
+            LIMIT 1
+        )
+    )
+    FROM sessions, answered;
+$$ LANGUAGE sql STABLE;
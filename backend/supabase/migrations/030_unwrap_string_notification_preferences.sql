@@ -0,0 +1,12 @@
+-- Migration: Unwrap double-encoded notification preferences
+-- Purpose: Preference updates used to send the notification settings as JSON text,
+--          storing a JSONB string instead of an object; convert those rows back
+-- Date: 2026-10-16
+
+UPDATE user_preferences
+SET email_notifications = (email_notifications #>> '{}')::jsonb
+WHERE jsonb_typeof(email_notifications) = 'string';
+
+UPDATE user_preferences
+SET push_notifications = (push_notifications #>> '{}')::jsonb
+WHERE jsonb_typeof(push_notifications) = 'string';
@@ -0,0 +1,24 @@
+-- Migration: Load the profile page data with a single function
+-- Purpose: Return the user's profile, preferences and stats together so the
+--          profile endpoint needs one round-trip instead of one per table
+-- Date: 2026-10-16
+
+CREATE OR REPLACE FUNCTION load_profile_bundle(p_user_id UUID)
+RETURNS JSONB AS $$
+    WITH profile AS (
+        SELECT *
+        FROM users
+        WHERE id = p_user_id
+    ),
+    preferences AS (
+        SELECT *
+        FROM user_preferences
+        WHERE user_id = p_user_id
+        LIMIT 1
+    )
+    SELECT jsonb_build_object(
+        'profile', (SELECT to_jsonb(profile) FROM profile),
+        'preferences', (SELECT to_jsonb(preferences) FROM preferences),
+        'stats', get_user_profile_stats(p_user_id)
+    );
+$$ LANGUAGE sql STABLE;
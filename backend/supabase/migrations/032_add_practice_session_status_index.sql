@@ -0,0 +1,10 @@
+-- Migration: Index practice sessions by study plan and status
+-- Purpose: Back the completed-session aggregates in get_user_profile_stats, which
+--          filter a plan's sessions by status
+-- Date: 2026-10-16
+--
+-- The latest-snapshot lookup is already covered by idx_performance_snapshots_user_time
+-- (014) and answered-question counts by idx_session_questions_status (005)
+
+CREATE INDEX IF NOT EXISTS idx_practice_sessions_plan_status
+ON practice_sessions(study_plan_id, status);
@@ -298,6 +298,7 @@ function QuickPracticeContent() {
           "Content-Type": "application/json",
         },
         body: JSON.stringify({
+          question_id: currentQuestion.id,
           question_stem: currentQuestion.stem,
           question_type: currentQuestion.question_type,
           correct_answer: correctAnswer,
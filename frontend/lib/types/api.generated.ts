@@ -1616,6 +1616,35 @@ export interface paths {
         patch?: never;
         trace?: never;
     };
+    "/api/ai-feedback/stream": {
+        parameters: {
+            query?: never;
+            header?: never;
+            path?: never;
+            cookie?: never;
+        };
+        get?: never;
+        put?: never;
+        /**
+         * Stream Ai Feedback
+         * @description Stream AI-generated feedback for a practice question as server-sent events.
+         *
+         *     Each event is a JSON object: {"type": "field", "name", "value"} as soon as a
+         *     feedback field is complete, followed by {"type": "done", "feedback"}.
+         *
+         *     Args:
+         *         request: Feedback request with question details and user performance
+         *
+         *     Returns:
+         *         text/event-stream response
+         */
+        post: operations["stream_ai_feedback_api_ai_feedback_stream_post"];
+        delete?: never;
+        options?: never;
+        head?: never;
+        patch?: never;
+        trace?: never;
+    };
     "/api/ai-feedback/chat": {
         parameters: {
             query?: never;
@@ -2918,6 +2947,8 @@ export interface components {
             user_performance_context: {
                 [key: string]: number;
             };
+            /** Question Id */
+            question_id?: string | null;
         };
         /**
          * AIFeedbackRequest
@@ -4753,6 +4784,39 @@ export interface operations {
             };
         };
     };
+    stream_ai_feedback_api_ai_feedback_stream_post: {
+        parameters: {
+            query?: never;
+            header?: never;
+            path?: never;
+            cookie?: never;
+        };
+        requestBody: {
+            content: {
+                "application/json": components["schemas"]["app__api__ai_feedback__AIFeedbackRequest"];
+            };
+        };
+        responses: {
+            /** @description Successful Response */
+            200: {
+                headers: {
+                    [name: string]: unknown;
+                };
+                content: {
+                    "text/event-stream": string;
+                };
+            };
+            /** @description Validation Error */
+            422: {
+                headers: {
+                    [name: string]: unknown;
+                };
+                content: {
+                    "application/json": components["schemas"]["HTTPValidationError"];
+                };
+            };
+        };
+    };
     chat_with_ai_api_ai_feedback_chat_post: {
         parameters: {
             query?: never;